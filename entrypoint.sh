@@ -8,6 +8,14 @@ then
       sleep 0.1
     done
 
+    # Shard nodes "host:port[/name]"
+    for node in $POSTGRES_SHARDS; do
+      address=${node%%/*}
+      while ! nc -z ${address%:*} ${address##*:}; do
+        sleep 0.1
+      done
+    done
+
     echo "PostgreSQL has been started."
 fi
 
@@ -1,5 +1,7 @@
 -- Initial schema for PostgreSQL.
 
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
 CREATE TYPE currency_type AS ENUM (
   'USD',
   'UAH',
@@ -12,10 +14,14 @@ CREATE TABLE account (
     name             varchar(512) UNIQUE NOT NULL,
     balance          numeric(9, 2) NOT NULL CHECK (balance >= 0), -- or money data type
     currency         currency_type NOT NULL,
+    version          integer NOT NULL DEFAULT 1, -- bumped on every balance change, optimistic concurrency and ETag
     created_at       timestamp NOT NULL DEFAULT NOW()
 );
 
-CREATE INDEX CONCURRENTLY idx_account_name on account (name);
+-- UNIQUE already indexes name for exact lookups, these serve `?search=`:
+-- prefix LIKE 'name%' and fuzzy trigram similarity name % 'name'.
+CREATE INDEX CONCURRENTLY idx_account_name on account (name varchar_pattern_ops);
+CREATE INDEX CONCURRENTLY idx_account_name_trgm on account USING gin (name gin_trgm_ops);
 CREATE INDEX CONCURRENTLY idx_account_created_at_brin ON account USING brin(created_at);
 
 
@@ -27,7 +33,7 @@ CREATE TYPE direction_type AS ENUM (
 CREATE TABLE payment (
     id               serial NOT NULL,
     account_id       bigint NOT NULL REFERENCES account (id),
-    to_account_id    bigint NOT NULL REFERENCES account (id),
+    to_account_id    bigint NOT NULL, -- may live on another shard, checked by payments.service
     amount           numeric(9, 2) NOT NULL CHECK (amount > 0),
     direction        direction_type NOT NULL,
     created_at       timestamp NOT NULL DEFAULT NOW()
@@ -60,3 +66,139 @@ LANGUAGE plpgsql;
 -- Create partitions for table payment from now to 1 YEAR in future over each month.
 SELECT create_partitions('payment', day::date) FROM generate_series
   (date_trunc('month', current_date), current_date + INTERVAL '1 YEAR', '1 MONTH'::interval) day;
+
+
+-- Turnover rollups, maintained in the payment transaction, see payments.service.TurnoverRollup.
+CREATE TYPE period_type AS ENUM (
+  'day',
+  'month'
+);
+
+-- Per account: money in (incoming) and out (outgoing) of the account.
+CREATE TABLE account_turnover (
+    id               serial PRIMARY KEY NOT NULL,
+    account_id       bigint NOT NULL REFERENCES account (id),
+    period           period_type NOT NULL,
+    period_start     date NOT NULL,
+    incoming_count   integer NOT NULL DEFAULT 0,
+    incoming_amount  numeric(15, 2) NOT NULL DEFAULT 0,
+    outgoing_count   integer NOT NULL DEFAULT 0,
+    outgoing_amount  numeric(15, 2) NOT NULL DEFAULT 0,
+    UNIQUE (account_id, period, period_start)
+);
+
+-- Per currency: payments by direction. Striped by account to avoid one hot row per currency,
+-- readers sum over stripes.
+CREATE TABLE currency_turnover (
+    id               serial PRIMARY KEY NOT NULL,
+    currency         currency_type NOT NULL,
+    period           period_type NOT NULL,
+    period_start     date NOT NULL,
+    stripe           smallint NOT NULL,
+    incoming_count   integer NOT NULL DEFAULT 0,
+    incoming_amount  numeric(15, 2) NOT NULL DEFAULT 0,
+    outgoing_count   integer NOT NULL DEFAULT 0,
+    outgoing_amount  numeric(15, 2) NOT NULL DEFAULT 0,
+    UNIQUE (currency, period, period_start, stripe)
+);
+
+
+-- Rebuild turnover rollups from the whole payment history.
+-- Maintenance only (e.g. after upgrade): full scan of payment, blocks new payments until done.
+-- Refuses to run on a shard of several: rollups of cross-shard payments come from payments on other shards.
+CREATE OR REPLACE FUNCTION rebuild_turnover() RETURNS VOID AS
+$BODY$
+BEGIN
+  IF (
+    SELECT increment_by FROM pg_sequences WHERE schemaname = current_schema() AND sequencename = 'payment_id_seq'
+  ) > 1 THEN
+    RAISE EXCEPTION 'rebuild_turnover() can not run on a sharded node, it would drop rollups of cross-shard payments';
+  END IF;
+  LOCK TABLE payment IN SHARE MODE;
+  TRUNCATE account_turnover, currency_turnover;
+
+  INSERT INTO account_turnover
+    (account_id, period, period_start, incoming_count, incoming_amount, outgoing_count, outgoing_amount)
+  SELECT
+    side.account_id,
+    periods.period,
+    date_trunc(periods.period::text, pay.created_at)::date,
+    count(*) FILTER (WHERE side.incoming),
+    coalesce(sum(pay.amount) FILTER (WHERE side.incoming), 0),
+    count(*) FILTER (WHERE NOT side.incoming),
+    coalesce(sum(pay.amount) FILTER (WHERE NOT side.incoming), 0)
+  FROM payment pay
+  CROSS JOIN LATERAL (VALUES
+    (pay.account_id, pay.direction = 'incoming'),
+    (pay.to_account_id, pay.direction = 'outgoing')
+  ) AS side (account_id, incoming)
+  CROSS JOIN (VALUES ('day'::period_type), ('month'::period_type)) AS periods (period)
+  GROUP BY 1, 2, 3;
+
+  INSERT INTO currency_turnover
+    (currency, period, period_start, stripe, incoming_count, incoming_amount, outgoing_count, outgoing_amount)
+  SELECT
+    acc.currency,
+    periods.period,
+    date_trunc(periods.period::text, pay.created_at)::date,
+    0,
+    count(*) FILTER (WHERE pay.direction = 'incoming'),
+    coalesce(sum(pay.amount) FILTER (WHERE pay.direction = 'incoming'), 0),
+    count(*) FILTER (WHERE pay.direction = 'outgoing'),
+    coalesce(sum(pay.amount) FILTER (WHERE pay.direction = 'outgoing'), 0)
+  FROM payment pay
+  JOIN account acc ON acc.id = pay.account_id
+  CROSS JOIN (VALUES ('day'::period_type), ('month'::period_type)) AS periods (period)
+  GROUP BY 1, 2, 3;
+END;
+$BODY$
+LANGUAGE plpgsql;
+
+
+-- Payment events outbox, written in the payment transaction, see payments.events.
+-- Readers only see events of finished transactions: txid < txid_snapshot_xmin(txid_current_snapshot()),
+-- so (txid, id) is a stable resumable cursor.
+CREATE TABLE payment_event (
+    id               bigserial PRIMARY KEY NOT NULL,
+    txid             bigint NOT NULL DEFAULT txid_current(),
+    payment_id       bigint NOT NULL,
+    account_id       bigint NOT NULL REFERENCES account (id),
+    to_account_id    bigint NOT NULL,
+    payload          jsonb NOT NULL,
+    created_at       timestamp NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX idx_payment_event_txid_id ON payment_event (txid, id);
+
+
+-- Sharding, see payments.sharding.
+-- Account and payment ids are interleaved between shards: shard = (id - 1) % shards.
+-- Run once on every shard, shard is 0-based, e.g. SELECT configure_shard(1, 3);
+CREATE OR REPLACE FUNCTION configure_shard(shard integer, shards integer) RETURNS VOID AS
+$BODY$
+DECLARE
+    seq text;
+    next_id bigint;
+BEGIN
+  FOREACH seq IN ARRAY ARRAY['account', 'payment'] LOOP
+    EXECUTE format('SELECT coalesce(max(id), 0) + 1 FROM %I', seq) INTO next_id;
+    -- Smallest id >= next_id on this shard
+    next_id := next_id + ((shard + 1 - next_id) % shards + shards) % shards;
+    EXECUTE format('ALTER SEQUENCE %I INCREMENT BY %s RESTART WITH %s', seq || '_id_seq', shards, next_id);
+  END LOOP;
+END;
+$BODY$
+LANGUAGE plpgsql;
+
+-- Decisions of cross-shard payments (two-phase commit), used on the first shard only.
+-- The payment inserts `commit`, recovery claims `abort` for a stalled one, the first row wins.
+CREATE TYPE transfer_outcome AS ENUM (
+    'commit',
+    'abort'
+);
+
+CREATE TABLE payment_transfer_decision (
+    gid              text PRIMARY KEY NOT NULL,
+    outcome          transfer_outcome NOT NULL,
+    created_at       timestamp NOT NULL DEFAULT NOW()
+);
@@ -0,0 +1,40 @@
+"""Gunicorn config for the API-only profile.
+
+Usage: ``gunicorn -c python:accounts.gunicorn_conf accounts.wsgi:application``
+
+The application is loaded once in the master process and forked, so workers
+start with Django already set up and the metadata caches already warm. Sync
+workers serve requests in their main thread, which opens the database
+connections right after fork.
+
+The events feed runs in its own service, see `accounts.gunicorn_events_conf`.
+"""
+
+import os
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8888")
+workers = int(os.environ.get("GUNICORN_WORKERS", 3))
+preload_app = True
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "accounts.settings_api")
+
+
+def when_ready(server):  # pylint: disable=W0613
+    """Check databases and warm metadata in the master, before fork."""
+    from django.core.management import call_command  # pylint: disable=C0415
+    from django.db import connections  # pylint: disable=C0415
+
+    from accounts import warmup  # pylint: disable=C0415
+
+    # Refuse to serve with unconfigured shards, see `payments.sharding`
+    call_command("check", tags=["database"])
+    warmup.warm_metadata()
+    # Do not leak master connections into workers
+    connections.close_all()
+
+
+def post_fork(server, worker):  # pylint: disable=W0613
+    """Open worker database connections before the first request."""
+    from accounts import warmup  # pylint: disable=C0415
+
+    warmup.warm_connections()
@@ -0,0 +1,23 @@
+"""Gunicorn config for the payment events feed.
+
+Usage:
+``gunicorn -c python:accounts.gunicorn_events_conf accounts.wsgi:application``
+
+Serves `/api/v1/events/` only, nginx routes it here. An open stream or long
+poll holds one thread, so workers run a large thread pool. Waiting threads
+hold no database connection and connections are closed after every request
+(`DJANGO_CONN_MAX_AGE=0`), a worker keeps one listener connection per shard.
+"""
+
+import os
+
+from accounts.gunicorn_conf import preload_app, when_ready  # noqa: F401 pylint: disable=W0611
+
+bind = os.environ.get("GUNICORN_EVENTS_BIND", "0.0.0.0:8889")
+workers = int(os.environ.get("GUNICORN_EVENTS_WORKERS", 2))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_EVENTS_THREADS", 1000))
+# Above the longest events long poll, see `payments.serializers`
+timeout = int(os.environ.get("GUNICORN_EVENTS_TIMEOUT", 60))
+
+os.environ.setdefault("DJANGO_CONN_MAX_AGE", "0")
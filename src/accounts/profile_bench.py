@@ -0,0 +1,76 @@
+"""Compare settings profiles: worker boot time and per-request overhead.
+
+Usage: ``python -m accounts.profile_bench [settings modules ...]``
+
+Every measurement runs in a fresh interpreter, the settings module can not be
+switched inside one process. Requests go to the API root, which does not touch
+the database, so only the framework overhead is measured.
+"""
+
+import os
+import subprocess
+import sys
+import timeit
+
+PROFILES = ["accounts.settings", "accounts.settings_api"]
+BOOT_RUNS = 20
+REQUESTS = 1000
+URL = "/api/v1/"
+
+
+def boot() -> float:
+    """Time to set up Django and load the WSGI application, in ms."""
+    start = timeit.default_timer()
+    from django.core.wsgi import get_wsgi_application  # pylint: disable=C0415
+
+    get_wsgi_application()
+    return (timeit.default_timer() - start) * 1000
+
+
+def request() -> float:
+    """Best mean time of one request through the WSGI handler, in µs."""
+    from wsgiref.util import setup_testing_defaults  # pylint: disable=C0415
+
+    from django.conf import settings  # pylint: disable=C0415
+    from django.core.wsgi import get_wsgi_application  # pylint: disable=C0415
+
+    application = get_wsgi_application()
+    environ = {"PATH_INFO": URL, "HTTP_HOST": settings.ALLOWED_HOSTS[0]}
+    setup_testing_defaults(environ)
+    statuses = []
+
+    def call():
+        b"".join(application(dict(environ), lambda status, headers: statuses.append(status)))
+
+    call()
+    assert statuses[0].startswith("200"), statuses[0]
+    return min(timeit.repeat(call, number=REQUESTS, repeat=5)) / REQUESTS * 1e6
+
+
+def run(profile: str, measure: str) -> float:
+    """Run one measurement in a child interpreter."""
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=profile)
+    out = subprocess.run(
+        [sys.executable, "-m", "accounts.profile_bench", "--child", measure],
+        env=env,
+        check=True,
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    return float(out.stdout)
+
+
+def main(profiles) -> None:
+    """Print a comparison table."""
+    print(f"{'profile':<24} {'boot, ms':>10} {'request, us':>12}")
+    for profile in profiles:
+        boot_ms = min(run(profile, "boot") for _ in range(BOOT_RUNS))
+        request_us = run(profile, "request")
+        print(f"{profile:<24} {boot_ms:>10.1f} {request_us:>12.1f}")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--child"]:
+        print({"boot": boot, "request": request}[sys.argv[2]]())
+    else:
+        main(sys.argv[1:] or PROFILES)
@@ -37,6 +37,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "rest_framework",
     "payments.apps.PaymentsConfig",
 ]
@@ -87,6 +88,27 @@ DATABASES = {
     }
 }
 
+# Account shards, see payments.sharding.
+# Extra PostgreSQL nodes "host:port[/name]" separated by spaces,
+# same user and password as the default database.
+# The host may be a unix socket directory, e.g. "/var/run/postgresql:5433".
+SHARDS = ["default"]
+for number, node in enumerate(os.environ.get("POSTGRES_SHARDS", "").split(), start=1):
+    host, _, address = node.rpartition(":")
+    port, _, name = address.partition("/")
+    alias = f"shard{number}"
+    DATABASES[alias] = {
+        **DATABASES["default"],
+        "NAME": name or DATABASES["default"]["NAME"],
+        "HOST": host,
+        "PORT": port,
+        "TEST": {"NAME": f"{DATABASES['default']['TEST']['NAME']}_{alias}"},
+    }
+    SHARDS.append(alias)
+# Threads per shard for queries over all shards, one per concurrent request
+# of a process: 1 for sync gunicorn workers.
+SHARD_POOL_SIZE = int(os.environ.get("SHARD_POOL_SIZE", default=1))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -125,6 +147,11 @@ SQL_PATH = os.path.join(os.path.dirname(BASE_DIR), "sql")
 
 TEST_RUNNER = "accounts.test_runner.TestRunner"
 
+# Payment concurrency control, see payments.service.AccountPayment:
+# "locking" locks both accounts, "optimistic" retries on a version conflict.
+PAYMENT_CONCURRENCY = os.environ.get("PAYMENT_CONCURRENCY", default="locking")
+PAYMENT_OPTIMISTIC_RETRIES = int(os.environ.get("PAYMENT_OPTIMISTIC_RETRIES", default=10))
+
 
 # App settings
 REST_FRAMEWORK = {
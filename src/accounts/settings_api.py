@@ -0,0 +1,57 @@
+"""
+API-only Django settings for accounts project.
+
+Production profile for the JSON payment API. Extends the base settings and
+drops everything a browser-facing site needs: admin, auth, sessions,
+messages, CSRF, clickjacking protection and the template engine.
+
+Enable it with ``DJANGO_SETTINGS_MODULE=accounts.settings_api``.
+"""
+
+import os
+
+from accounts.settings import *  # noqa: F401,F403 pylint: disable=W0401,W0614
+from accounts.settings import DATABASES, REST_FRAMEWORK
+
+# Application definition
+
+# `staticfiles` stays so `collectstatic` in entrypoint.sh keeps working,
+# it adds no middleware and costs nothing per request.
+INSTALLED_APPS = [
+    "django.contrib.staticfiles",
+    "django.contrib.postgres",
+    "rest_framework",
+    "payments.apps.PaymentsConfig",
+]
+
+MIDDLEWARE = ["django.middleware.security.SecurityMiddleware", "django.middleware.common.CommonMiddleware"]
+
+# JSON renderer only, no browsable API, so no template engine is needed.
+TEMPLATES = []
+
+AUTH_PASSWORD_VALIDATORS = []
+
+
+# Database
+# Keep worker connections open between requests, see `accounts.gunicorn_conf`.
+
+DATABASES = {
+    alias: {**database, "CONN_MAX_AGE": int(os.environ.get("DJANGO_CONN_MAX_AGE", default=60))}
+    for alias, database in DATABASES.items()
+}
+
+
+# App settings
+REST_FRAMEWORK = {
+    **REST_FRAMEWORK,
+    "DEFAULT_RENDERER_CLASSES": ["rest_framework.renderers.JSONRenderer"],
+    "DEFAULT_PARSER_CLASSES": [
+        "rest_framework.parsers.JSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ],
+    # Without `django.contrib.auth` there are no users to authenticate
+    "DEFAULT_AUTHENTICATION_CLASSES": [],
+    "DEFAULT_PERMISSION_CLASSES": ["rest_framework.permissions.AllowAny"],
+    "UNAUTHENTICATED_USER": None,
+}
@@ -4,7 +4,7 @@ import os
 
 import sqlparse
 from django.conf import settings
-from django.db import connection
+from django.db import connections
 from django.test.runner import DiscoverRunner
 
 
@@ -12,17 +12,26 @@ class TestRunner(DiscoverRunner):
     """Custom test runner for initial SQL."""
 
     @staticmethod
-    def execute_sql_from_file(filename="init.sql"):
+    def execute_sql_from_file(filename="init.sql", using="default"):
         """Execute sql from file."""
         file_path = os.path.join(settings.SQL_PATH, filename)
         statements = sqlparse.split(open(file_path, "r").read())
         for stm in statements:
-            with connection.cursor() as cur:
+            with connections[using].cursor() as cur:
                 if stm:
                     cur.execute(stm)
 
-    def setup_databases(self, **kwargs):
-        """Create test database and apply initial SQL."""
-        test_db = super().setup_databases(**kwargs)
-        self.execute_sql_from_file()
+    def setup_databases(self, aliases=None, **kwargs):  # pylint: disable=W0221
+        """Create test databases and apply initial SQL on their shards.
+
+        Only the databases of the selected tests are created, never touch
+        the others.
+        """
+        test_db = super().setup_databases(aliases=aliases, **kwargs)
+        for shard, alias in enumerate(settings.SHARDS):
+            if aliases is not None and alias not in aliases:
+                continue
+            self.execute_sql_from_file(using=alias)
+            with connections[alias].cursor() as cur:
+                cur.execute("SELECT configure_shard(%s, %s)", [shard, len(settings.SHARDS)])
         return test_db
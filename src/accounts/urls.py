@@ -11,6 +11,8 @@ from payments import views as pay_views
 router = routers.DefaultRouter()  # pylint: disable=C0103
 router.register(r"accounts", pay_views.AccountViewSet)
 router.register(r"payments", pay_views.PaymentViewSet)
+router.register(r"stats", pay_views.StatsViewSet, basename="stats")
+router.register(r"events", pay_views.EventViewSet, basename="events")
 
 
 urlpatterns = [url(r"^api/v1/", include((router.urls, "account_service"), namespace="v1"))]  # pylint: disable=C0103
@@ -0,0 +1,42 @@
+"""Worker warm up.
+
+Pay the lazy initialisation costs at process start instead of on the first
+requests: URL resolver, DRF settings, model and serializer metadata and the
+database connections.
+"""
+
+from django.db import OperationalError, connections
+from django.urls import get_resolver
+from rest_framework.settings import api_settings
+
+from accounts.urls import router
+
+
+def warm_metadata() -> None:
+    """Populate URL, DRF and serializer caches.
+
+    Safe to call before fork, children share the populated caches.
+    """
+    resolver = get_resolver()
+    resolver.reverse_dict  # pylint: disable=W0104
+    for setting in ("DEFAULT_RENDERER_CLASSES", "DEFAULT_PARSER_CLASSES", "DEFAULT_PAGINATION_CLASS"):
+        getattr(api_settings, setting)
+    for _prefix, viewset, _basename in router.registry:
+        if getattr(viewset, "serializer_class", None) is None:
+            continue
+        viewset.queryset.model._meta.get_fields()  # pylint: disable=W0212
+        viewset.serializer_class().fields  # pylint: disable=W0104
+
+
+def warm_connections() -> None:
+    """Open database connections of every shard.
+
+    Must be called after fork in the thread serving requests, connections
+    can not be shared between processes or threads. Best effort: if the
+    database is not reachable yet the first request reconnects.
+    """
+    for conn in connections.all():
+        try:
+            conn.ensure_connection()
+        except OperationalError:
+            pass
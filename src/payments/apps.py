@@ -1,9 +1,16 @@
 """Django payments app."""
 
 from django.apps import AppConfig
+from django.core import checks
 
 
 class PaymentsConfig(AppConfig):
     """Payment app config."""
 
     name = "payments"
+
+    def ready(self):
+        """Register system checks."""
+        from payments.sharding import check_shards  # pylint: disable=C0415
+
+        checks.register(check_shards, checks.Tags.database)
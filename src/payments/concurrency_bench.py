@@ -0,0 +1,95 @@
+"""Compare payment concurrency modes across contention levels.
+
+Usage: ``python -m payments.concurrency_bench``
+
+Runs in a throwaway test database. Worker threads make payments between
+random accounts of a pool, the smaller the pool the higher the contention.
+Failed payments are conflicts the service gave up on (409).
+"""
+
+import os
+import random
+import statistics
+import sys
+import threading
+import timeit
+from decimal import Decimal
+
+MODES = ["locking", "optimistic"]
+POOLS = [2, 8, 32, 256]
+THREADS = 8
+PAYMENTS = 400
+
+
+def worker(account_ids, payments, latencies, failures) -> None:
+    """Make payments between random accounts."""
+    from django.db import connections  # pylint: disable=C0415
+
+    from payments import errors  # pylint: disable=C0415
+    from payments.models import Payment  # pylint: disable=C0415
+    from payments.service import AccountPayment  # pylint: disable=C0415
+
+    for _ in range(payments):
+        account_id, to_account_id = random.sample(account_ids, 2)
+        start = timeit.default_timer()
+        try:
+            AccountPayment.transaction(
+                account_id=account_id, direction=Payment.OUTGOING, amount=Decimal("1"), to_account_id=to_account_id
+            )
+        except errors.AccountPaymentTransactionError:
+            failures.append(account_id)
+        latencies.append((timeit.default_timer() - start) * 1000)
+    connections.close_all()
+
+
+def run(mode: str, pool: int) -> dict:
+    """Run one level, return payments/s, latency percentiles and failures."""
+    from django.test import override_settings  # pylint: disable=C0415
+
+    from payments.models import Account  # pylint: disable=C0415
+
+    account_ids = [
+        Account.objects.create(name=f"bench_{mode}_{pool}_{i}", balance=Decimal("99999"), currency=Account.USD).id
+        for i in range(pool)
+    ]
+    latencies, failures = [], []
+    threads = [
+        threading.Thread(target=worker, args=(account_ids, PAYMENTS // THREADS, latencies, failures))
+        for _ in range(THREADS)
+    ]
+    with override_settings(PAYMENT_CONCURRENCY=mode):
+        start = timeit.default_timer()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = timeit.default_timer() - start
+    percentiles = statistics.quantiles(latencies, n=100)
+    return dict(rate=len(latencies) / elapsed, p50=percentiles[49], p99=percentiles[98], failed=len(failures))
+
+
+def main(modes) -> None:
+    """Print a comparison table."""
+    import django  # pylint: disable=C0415
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "accounts.settings")
+    django.setup()
+    from accounts.test_runner import TestRunner  # pylint: disable=C0415
+
+    runner = TestRunner(verbosity=0, interactive=False)
+    old_config = runner.setup_databases()
+    try:
+        print(f"{'accounts':>8} {'mode':<12} {'payments/s':>10} {'p50, ms':>8} {'p99, ms':>8} {'failed':>6}")
+        for pool in POOLS:
+            for mode in modes:
+                result = run(mode, pool)
+                print(
+                    f"{pool:>8} {mode:<12} {result['rate']:>10.0f} {result['p50']:>8.1f} {result['p99']:>8.1f} "
+                    f"{result['failed']:>6}"
+                )
+    finally:
+        runner.teardown_databases(old_config)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:] or MODES)
@@ -35,9 +35,41 @@ class AccountSelfError(ValidationError):
     default_code = "bad_request"
 
 
+class AccountSearchError(ValidationError):
+    """Account search query error."""
+
+    status_code = 400
+    default_detail = "Error, the search query must be at least 3 characters!"
+    default_code = "bad_request"
+
+
+class StatsRangeError(ValidationError):
+    """Statistics date range error."""
+
+    status_code = 400
+    default_detail = "The start value must not be after the end value."
+    default_code = "bad_request"
+
+
+class EventCursorError(ValidationError):
+    """Payment events cursor error."""
+
+    status_code = 400
+    default_detail = "Error, invalid events cursor!"
+    default_code = "bad_request"
+
+
 class AccountPaymentTransactionError(APIException):
     """Account payment transaction error."""
 
     status_code = 409
     default_detail = "Error, account payment transaction conflict!"
     default_code = "conflict"
+
+
+class AccountPaymentInDoubtError(APIException):
+    """Cross-shard payment decision is unknown, recovery finishes it."""
+
+    status_code = 503
+    default_detail = "Error, account payment outcome is unknown, check the account balance later!"
+    default_code = "service_unavailable"
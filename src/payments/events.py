@@ -0,0 +1,305 @@
+"""Payment events feed.
+
+Events are written to the `payment_event` outbox of the payment shard in
+the payment transaction and announced with NOTIFY on commit. One listener
+thread per shard and process reads every new event once and fans it out to
+all subscribers in memory, so waiting subscribers cost no database queries.
+
+A feed cursor holds one position per shard. The feed of a shard stops at
+the oldest running transaction (`HORIZON`), an in-doubt cross-shard payment
+holds it back until `manage.py recover_transfers` finishes it.
+"""
+
+import json
+import logging
+import os
+import select
+import threading
+import time
+from collections import deque
+from itertools import takewhile
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+import psycopg2
+from django.conf import settings
+from django.db import connections
+from rest_framework.utils.encoders import JSONEncoder
+
+from payments import errors
+from payments.models import Payment
+from payments.serializers import PaymentSerializer
+from payments.sharding import shard_for_id
+
+logger = logging.getLogger(__name__)  # pylint: disable=C0103
+
+CHANNEL = "payment_event"
+BUFFER_SIZE = 10000
+FETCH_LIMIT = 1000
+POLL_INTERVAL = 1.0
+HEARTBEAT = 15.0
+
+Cursor = Tuple[int, int]
+FeedCursor = List[Cursor]
+
+# Only events of finished transactions, nothing can commit before them later
+HORIZON = "txid < txid_snapshot_xmin(txid_current_snapshot())"
+
+INSERT_SQL = """
+    INSERT INTO payment_event (payment_id, account_id, to_account_id, payload)
+    VALUES (%s, %s, %s, %s::jsonb)
+    RETURNING txid, id
+"""
+NOTIFY_SQL = f"""
+    WITH event AS ({INSERT_SQL})
+    SELECT pg_notify('{CHANNEL}', txid || '-' || id) FROM event
+"""
+FETCH_SQL = f"""
+    SELECT txid, id, account_id, to_account_id, payload FROM payment_event
+    WHERE (txid, id) > (%s, %s) AND {HORIZON}
+    ORDER BY txid, id LIMIT %s
+"""
+FETCH_RANGE_SQL = """
+    SELECT txid, id, account_id, to_account_id, payload FROM payment_event
+    WHERE (txid, id) > (%s, %s) AND (txid, id) <= (%s, %s) {account}
+    ORDER BY txid, id LIMIT %s
+"""
+LAST_SQL = f"SELECT txid, id FROM payment_event WHERE {HORIZON} ORDER BY txid DESC, id DESC LIMIT 1"
+
+
+class Event(NamedTuple):
+    """Payment event."""
+
+    shard: int
+    cursor: Cursor
+    account_id: int
+    to_account_id: int
+    payload: dict
+
+    @classmethod
+    def from_row(cls, shard: int, row: tuple) -> "Event":
+        """Event from `payment_event` row of the shard."""
+        txid, event_id, account_id, to_account_id, payload = row
+        return cls(shard, (txid, event_id), account_id, to_account_id, payload)
+
+    def match(self, account_id: Optional[int]) -> bool:
+        """Check the event is about the account."""
+        return account_id is None or account_id in (self.account_id, self.to_account_id)
+
+
+def format_cursor(cursor: FeedCursor) -> str:
+    """Cursor to string, shard positions separated by dots."""
+    return ".".join("{}-{}".format(*position) for position in cursor)
+
+
+def parse_cursor(value: str) -> FeedCursor:
+    """Cursor from string."""
+    try:
+        cursor = [tuple(int(part) for part in position.split("-")) for position in value.split(".")]
+    except ValueError:
+        raise errors.EventCursorError
+    if len(cursor) != len(settings.SHARDS) or any(len(position) != 2 for position in cursor):
+        raise errors.EventCursorError
+    return cursor
+
+
+def record(payment: Payment, notify: bool = True) -> None:
+    """Write payment event, must be called in the payment transaction.
+
+    NOTIFY is delivered on commit, never for rolled back payments. Without
+    it the listener reads the event on its next poll.
+    """
+    payload = json.dumps(PaymentSerializer(payment).data, cls=JSONEncoder)
+    sql = NOTIFY_SQL if notify else INSERT_SQL
+    with connections[shard_for_id(payment.account_id)].cursor() as cur:
+        cur.execute(sql, [payment.id, payment.account_id, payment.to_account_id, payload])
+
+
+class ShardListener:
+    """Payment events listener of one shard.
+
+    Keeps the last `BUFFER_SIZE` events in memory, subscribers behind the
+    buffer catch up from the database once.
+    """
+
+    def __init__(self, shard: int, condition: threading.Condition):
+        self.shard = shard
+        self.alias = settings.SHARDS[shard]
+        self.buffer = deque()
+        self.condition = condition
+        self.closed = False
+        self.conn = self.connect()
+        with self.conn.cursor() as cur:
+            cur.execute(LAST_SQL)
+            row = cur.fetchone()
+        # Events in (floor, last] are buffered
+        self.last = self.floor = tuple(row) if row else (0, 0)
+        self.thread = threading.Thread(target=self.run, name=f"payment-event-{self.alias}", daemon=True)
+        self.thread.start()
+
+    def connect(self):
+        """Open dedicated listener connection."""
+        conn = psycopg2.connect(**connections[self.alias].get_connection_params())
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(f"LISTEN {CHANNEL}")
+        return conn
+
+    def close(self) -> None:
+        """Stop listener thread."""
+        self.closed = True
+        self.thread.join()
+
+    def run(self) -> None:
+        """Listener loop.
+
+        Fetch on every notification, and on timeout: an event may stay
+        behind the horizon until an older transaction finishes.
+        """
+        while not self.closed:
+            try:
+                select.select([self.conn], [], [], POLL_INTERVAL)
+                self.conn.poll()
+                self.conn.notifies.clear()
+                self.fetch()
+            except psycopg2.Error:
+                logger.exception("Payment events listener error on %s, reconnecting", self.alias)
+                time.sleep(POLL_INTERVAL)
+                self.reconnect()
+        self.conn.close()
+
+    def reconnect(self) -> None:
+        """Replace broken listener connection."""
+        try:
+            self.conn.close()
+            self.conn = self.connect()
+        except psycopg2.Error:
+            logger.exception("Payment events listener reconnect error on %s", self.alias)
+
+    def fetch(self) -> None:
+        """Read new events and wake up subscribers."""
+        while True:
+            with self.conn.cursor() as cur:
+                cur.execute(FETCH_SQL, [*self.last, FETCH_LIMIT])
+                events = [Event.from_row(self.shard, row) for row in cur.fetchall()]
+            if not events:
+                return
+            with self.condition:
+                for event in events:
+                    if len(self.buffer) == BUFFER_SIZE:
+                        self.floor = self.buffer.popleft().cursor
+                    self.buffer.append(event)
+                self.last = events[-1].cursor
+                self.condition.notify_all()
+            if len(events) < FETCH_LIMIT:
+                return
+
+    def read(self, cursor: Optional[Cursor], account_id: Optional[int]) -> Tuple[Cursor, List[Event]]:
+        """Events after cursor and the new cursor, without waiting."""
+        with self.condition:
+            floor, last = self.floor, self.last
+            if cursor is None or cursor >= last:
+                return cursor or last, []
+            tail = self.tail(max(cursor, floor))
+        events = []
+        if cursor < floor:
+            events = self.fetch_range(cursor, floor, account_id)
+            if len(events) == FETCH_LIMIT:
+                return events[-1].cursor, events
+        events += [event for event in tail if event.match(account_id)]
+        return last, events
+
+    def tail(self, cursor: Cursor) -> List[Event]:
+        """Buffered events after cursor, call with the condition held.
+
+        Subscribers are usually near the end, walk the buffer backwards.
+        """
+        events = list(takewhile(lambda event: event.cursor > cursor, reversed(self.buffer)))
+        events.reverse()
+        return events
+
+    def fetch_range(self, after: Cursor, until: Cursor, account_id: Optional[int]) -> List[Event]:
+        """Read events in (after, until] from the database."""
+        account, params = "", [*after, *until]
+        if account_id is not None:
+            account, params = "AND (account_id = %s OR to_account_id = %s)", params + [account_id, account_id]
+        with connections[self.alias].cursor() as cur:
+            cur.execute(FETCH_RANGE_SQL.format(account=account), params + [FETCH_LIMIT])
+            return [Event.from_row(self.shard, row) for row in cur.fetchall()]
+
+
+class EventHub:
+    """Process wide payment events feed over the listeners of all shards."""
+
+    _instance = None
+    _lock = threading.Lock()
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.condition = threading.Condition()
+        self.listeners = [ShardListener(shard, self.condition) for shard in range(len(settings.SHARDS))]
+
+    @classmethod
+    def instance(cls) -> "EventHub":
+        """Hub of this process, started on first use."""
+        with cls._lock:
+            if cls._instance is None or cls._instance.pid != os.getpid():
+                cls._instance = cls()
+            return cls._instance
+
+    @classmethod
+    def shutdown(cls) -> None:
+        """Stop the hub of this process."""
+        with cls._lock:
+            if cls._instance is not None and cls._instance.pid == os.getpid():
+                cls._instance.close()
+            cls._instance = None
+
+    def close(self) -> None:
+        """Stop listener threads."""
+        for listener in self.listeners:
+            listener.close()
+
+    def read(self, cursor: Optional[FeedCursor], account_id: Optional[int]) -> Tuple[FeedCursor, List[Event]]:
+        """Events after cursor and the new cursor, without waiting."""
+        positions, events = [], []
+        for listener, position in zip(self.listeners, cursor or [None] * len(self.listeners)):
+            position, shard_events = listener.read(position, account_id)
+            positions.append(position)
+            events += shard_events
+        return positions, events
+
+    def wait(
+        self, cursor: Optional[FeedCursor], account_id: Optional[int], timeout: float
+    ) -> Tuple[FeedCursor, List[Event]]:
+        """Events after cursor, wait up to timeout seconds for new ones."""
+        deadline = time.monotonic() + timeout
+        while True:
+            cursor, events = self.read(cursor, account_id)
+            if events:
+                return cursor, events
+            # Do not hold database connections while waiting
+            for conn in connections.all():
+                if not conn.in_atomic_block:
+                    conn.close()
+            with self.condition:
+                remaining = deadline - time.monotonic()
+                if all(listener.last <= position for listener, position in zip(self.listeners, cursor)):
+                    if remaining <= 0:
+                        return cursor, []
+                    self.condition.wait(remaining)
+
+    def stream(self, cursor: Optional[FeedCursor], account_id: Optional[int]) -> Iterator[str]:
+        """Server-sent events stream, endless.
+
+        Every event id is the feed cursor right after the event.
+        """
+        if cursor is None:
+            cursor, _ = self.read(cursor, account_id)
+        while True:
+            position = list(cursor)
+            cursor, events = self.wait(cursor, account_id, HEARTBEAT)
+            if not events:
+                yield ": keepalive\n\n"
+            for event in events:
+                position[event.shard] = event.cursor
+                yield f"id: {format_cursor(position)}\ndata: {json.dumps(event.payload)}\n\n"
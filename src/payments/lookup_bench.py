@@ -0,0 +1,65 @@
+"""Measure account lookup by exact name at scale.
+
+Usage: ``python -m payments.lookup_bench [accounts]``
+
+Runs in a throwaway test database filled with `accounts` accounts
+(default one million). Times `AccountSearch.exact`, the query behind
+`GET /api/v1/accounts/?name=`, for random existing and missing names.
+"""
+
+import os
+import random
+import statistics
+import sys
+import timeit
+
+ACCOUNTS = 1000000
+LOOKUPS = 2000
+
+FILL_SQL = """
+    INSERT INTO account (name, balance, currency)
+    SELECT 'bench_' || i, 0, 'USD' FROM generate_series(1, %s) i
+"""
+
+
+def measure(names) -> dict:
+    """Lookup latency percentiles, in ms."""
+    from payments.service import AccountSearch  # pylint: disable=C0415
+
+    latencies = []
+    for name in names:
+        start = timeit.default_timer()
+        AccountSearch.exact(name)
+        latencies.append((timeit.default_timer() - start) * 1000)
+    percentiles = statistics.quantiles(latencies, n=100)
+    return dict(p50=percentiles[49], p99=percentiles[98])
+
+
+def main(accounts: int) -> None:
+    """Print lookup latency."""
+    import django  # pylint: disable=C0415
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "accounts.settings")
+    django.setup()
+    from django.db import connection  # pylint: disable=C0415
+
+    from accounts.test_runner import TestRunner  # pylint: disable=C0415
+
+    runner = TestRunner(verbosity=0, interactive=False)
+    old_config = runner.setup_databases()
+    try:
+        with connection.cursor() as cur:
+            cur.execute(FILL_SQL, [accounts])
+            cur.execute("ANALYZE account")
+        existing = [f"bench_{random.randint(1, accounts)}" for _ in range(LOOKUPS)]
+        missing = [f"missing_{i}" for i in range(LOOKUPS)]
+        print(f"{'lookup':<10} {'accounts':>10} {'p50, ms':>8} {'p99, ms':>8}")
+        for label, names in [("existing", existing), ("missing", missing)]:
+            result = measure(names)
+            print(f"{label:<10} {accounts:>10} {result['p50']:>8.3f} {result['p99']:>8.3f}")
+    finally:
+        runner.teardown_databases(old_config)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if sys.argv[1:] else ACCOUNTS)
@@ -0,0 +1,21 @@
+"""Interleave account and payment ids between shards."""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+
+class Command(BaseCommand):
+    """Run `configure_shard` on every shard from `settings.SHARDS`.
+
+    Run once after `init.sql`, and again when shards are added to an empty
+    cluster. Existing rows are not moved.
+    """
+
+    help = "Interleave account and payment ids between shards."
+
+    def handle(self, *args, **options):
+        for shard, alias in enumerate(settings.SHARDS):
+            with connections[alias].cursor() as cur:
+                cur.execute("SELECT configure_shard(%s, %s)", [shard, len(settings.SHARDS)])
+            self.stdout.write(f"{alias}: shard {shard} of {len(settings.SHARDS)}")
@@ -0,0 +1,23 @@
+"""Finish in-doubt cross-shard payments."""
+
+from django.core.management.base import BaseCommand
+
+from payments.service import AccountPayment
+
+
+class Command(BaseCommand):
+    """Commit or roll back prepared transactions left by crashed workers.
+
+    Run periodically (cron) and after a shard restart.
+    """
+
+    help = "Finish in-doubt cross-shard payments."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--grace", type=int, default=60, help="Skip transactions prepared less than GRACE seconds ago."
+        )
+
+    def handle(self, *args, **options):
+        for gid, alias, committed in AccountPayment.recover(options["grace"]):
+            self.stdout.write(f"{'committed' if committed else 'rolled back'} {gid} on {alias}")
@@ -0,0 +1,45 @@
+"""Turnover rollup migrations."""
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    """Django database migration."""
+
+    dependencies = [("payments", "0001_initial")]
+
+    operations = [
+        migrations.CreateModel(
+            name="AccountTurnover",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("period", models.CharField(choices=[("day", "day"), ("month", "month")], max_length=5)),
+                ("period_start", models.DateField()),
+                ("incoming_count", models.IntegerField(default=0)),
+                ("incoming_amount", models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ("outgoing_count", models.IntegerField(default=0)),
+                ("outgoing_amount", models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+            ],
+            options={"db_table": "account_turnover", "ordering": ["period_start"], "managed": False},
+        ),
+        migrations.CreateModel(
+            name="CurrencyTurnover",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("period", models.CharField(choices=[("day", "day"), ("month", "month")], max_length=5)),
+                ("period_start", models.DateField()),
+                ("incoming_count", models.IntegerField(default=0)),
+                ("incoming_amount", models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ("outgoing_count", models.IntegerField(default=0)),
+                ("outgoing_amount", models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                (
+                    "currency",
+                    models.CharField(
+                        choices=[("USD", "USA USD"), ("UAH", "Ukraine UAH"), ("RUB", "Russia RUB")], max_length=50
+                    ),
+                ),
+                ("stripe", models.SmallIntegerField()),
+            ],
+            options={"db_table": "currency_turnover", "ordering": ["period_start"], "managed": False},
+        ),
+    ]
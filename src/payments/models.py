@@ -14,6 +14,7 @@ class Account(models.Model):
     name = models.CharField(unique=True, max_length=512)
     balance = models.DecimalField(max_digits=7, decimal_places=2)
     currency = models.CharField(max_length=50, choices=CURRENCY_TYPE_CHOICES)
+    version = models.IntegerField(default=1)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:  # pylint: disable=C0111
@@ -45,3 +46,52 @@ class Payment(models.Model):
 
     def __str__(self):
         return f"{self.account_id} -> {self.to_account_id}"
+
+
+class Turnover(models.Model):
+    """Common turnover rollup columns."""
+
+    DAY = "day"
+    MONTH = "month"
+    PERIOD_TYPE_CHOICES = ((DAY, DAY), (MONTH, MONTH))
+
+    period = models.CharField(max_length=5, choices=PERIOD_TYPE_CHOICES)
+    period_start = models.DateField()
+    incoming_count = models.IntegerField(default=0)
+    incoming_amount = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    outgoing_count = models.IntegerField(default=0)
+    outgoing_amount = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+
+    class Meta:  # pylint: disable=C0111
+        abstract = True
+
+
+class AccountTurnover(Turnover):
+    """Account turnover rollup table representations."""
+
+    account = models.ForeignKey(Account, models.DO_NOTHING, related_name="turnover")
+
+    class Meta:  # pylint: disable=C0111
+        managed = False
+        db_table = "account_turnover"
+        ordering = ["period_start"]
+        unique_together = [["account", "period", "period_start"]]
+
+    def __str__(self):
+        return f"{self.account_id} {self.period} {self.period_start}"
+
+
+class CurrencyTurnover(Turnover):
+    """Currency turnover rollup table representations."""
+
+    currency = models.CharField(max_length=50, choices=Account.CURRENCY_TYPE_CHOICES)
+    stripe = models.SmallIntegerField()
+
+    class Meta:  # pylint: disable=C0111
+        managed = False
+        db_table = "currency_turnover"
+        ordering = ["period_start"]
+        unique_together = [["currency", "period", "period_start", "stripe"]]
+
+    def __str__(self):
+        return f"{self.currency} {self.period} {self.period_start}"
@@ -0,0 +1,12 @@
+"""DRF pagination."""
+
+from rest_framework.pagination import CursorPagination
+
+
+class AccountNamePagination(CursorPagination):
+    """Keyset pagination over account names.
+
+    No `COUNT(*)` and no `OFFSET`, every page is an index range scan.
+    """
+
+    ordering = "name"
@@ -0,0 +1,15 @@
+"""DRF renderers."""
+
+from rest_framework.renderers import BaseRenderer
+
+
+class EventStreamRenderer(BaseRenderer):
+    """Server-sent events, the view streams the response body itself."""
+
+    media_type = "text/event-stream"
+    format = "event-stream"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """Render error responses as comments."""
+        return f": {data}\n\n".encode(self.charset)
@@ -1,11 +1,14 @@
 """DRF serializers."""
 
+from datetime import timedelta
 from decimal import Decimal
 
+from django.utils import timezone
 from rest_framework import serializers
 
 from payments import errors
-from payments.models import Account, Payment
+from payments.models import Account, Payment, Turnover
+from payments.sharding import shard_for_name
 
 
 class AccountSerializer(serializers.ModelSerializer):
@@ -15,6 +18,18 @@ class AccountSerializer(serializers.ModelSerializer):
         model = Account
         fields = ["id", "name", "balance", "currency", "created_at"]
         read_only_fields = ["created_at"]
+        # Name uniqueness is checked on the shard of the name
+        extra_kwargs = {"name": {"validators": []}}
+
+    def validate_name(self, value):  # pylint: disable=R0201
+        """Check that name is unique."""
+        if Account.objects.using(shard_for_name(value)).filter(name=value).exists():
+            raise serializers.ValidationError("account with this name already exists.")
+        return value
+
+    def create(self, validated_data):
+        """Create account on the shard of its name."""
+        return Account.objects.using(shard_for_name(validated_data["name"])).create(**validated_data)
 
 
 class PaymentSerializer(serializers.ModelSerializer):
@@ -40,3 +55,57 @@ class PaymentSerializer(serializers.ModelSerializer):
         if data["account_id"] == data["to_account_id"]:
             raise errors.AccountSelfError
         return data
+
+
+class TurnoverSerializer(serializers.Serializer):  # pylint: disable=W0223
+    """DRF turnover rollup serializer."""
+
+    period_start = serializers.DateField()
+    incoming_count = serializers.IntegerField()
+    incoming_amount = serializers.DecimalField(max_digits=15, decimal_places=2)
+    outgoing_count = serializers.IntegerField()
+    outgoing_amount = serializers.DecimalField(max_digits=15, decimal_places=2)
+
+
+class CurrencyTurnoverSerializer(TurnoverSerializer):  # pylint: disable=W0223
+    """DRF currency turnover rollup serializer."""
+
+    currency = serializers.CharField()
+
+
+class StatsQuerySerializer(serializers.Serializer):  # pylint: disable=W0223
+    """DRF statistics query parameters serializer.
+
+    Default range: last 30 days or last year. Ranges are capped, so the
+    response size does not grow with the account history.
+    """
+
+    MAX_DAYS = {Turnover.DAY: 366, Turnover.MONTH: 3653}
+
+    period = serializers.ChoiceField(choices=Turnover.PERIOD_TYPE_CHOICES, default=Turnover.DAY)
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    currency = serializers.ChoiceField(choices=Account.CURRENCY_TYPE_CHOICES, required=False)
+
+    def validate(self, data):
+        """Fill in and check date range."""
+        data = super().validate(data)
+        end = data.setdefault("end", timezone.now().date())
+        if "start" not in data:
+            days = 29 if data["period"] == Turnover.DAY else 365
+            data["start"] = end - timedelta(days=days)
+        if data["start"] > end:
+            raise errors.StatsRangeError
+        max_days = self.MAX_DAYS[data["period"]]
+        if (end - data["start"]).days + 1 > max_days:
+            raise errors.StatsRangeError(f"The range must not exceed {max_days} days for {data['period']} period.")
+        return data
+
+
+class EventQuerySerializer(serializers.Serializer):  # pylint: disable=W0223
+    """DRF payment events query parameters serializer."""
+
+    cursor = serializers.CharField(required=False)
+    account = serializers.IntegerField(required=False)
+    # Below events gunicorn `timeout` and nginx `proxy_read_timeout`, 60s
+    timeout = serializers.FloatField(default=25, min_value=0, max_value=50)
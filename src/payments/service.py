@@ -3,18 +3,41 @@
 Separate application logic out models and view representations.
 """
 
+import logging
+from contextlib import ExitStack
+from datetime import date
 from decimal import Decimal
-from typing import Tuple, Union
+from typing import List, Optional, Tuple, Union
+from uuid import uuid4
 
-from django.db import DatabaseError, IntegrityError, transaction
-from django.db.models import F
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DatabaseError, IntegrityError, connections, transaction
+from django.db.models import F, Q, QuerySet, Sum
 from django.db.transaction import TransactionManagementError
 
-from payments import errors
-from payments.models import Account, Payment
+from payments import errors, events
+from payments.models import Account, AccountTurnover, CurrencyTurnover, Payment, Turnover
+from payments.sharding import ShardedQuerySet, on_shards, shard_for_id, shard_for_name
+
+logger = logging.getLogger(__name__)  # pylint: disable=C0103
 
 DirectionType = Union[Payment.OUTGOING, Payment.OUTGOING]
 
+TWO_PHASE_PREFIX = "payment-"
+COMMIT = "commit"
+ABORT = "abort"
+
+LOCKING = "locking"
+OPTIMISTIC = "optimistic"
+
+TURNOVER_STRIPES = 16
+TURNOVER_FIELDS = ("incoming_count", "incoming_amount", "outgoing_count", "outgoing_amount")
+
+
+class AccountVersionConflict(Exception):
+    """Account changed after it was read, optimistic mode only."""
+
 
 class AccountPayment:
     """Base class for making payments.
@@ -38,36 +61,261 @@ class AccountPayment:
           * account balance - amount <= 0
           * same currency for account A and account B
           * account A/account B has enough balance
+
+        `settings.PAYMENT_CONCURRENCY`:
+          * locking - lock both accounts for the transaction
+          * optimistic - no locks for the checks, start over on a conflict
+        """
+        alias, to_alias = shard_for_id(account_id), shard_for_id(to_account_id)
+        payment_data = dict(account_id=account_id, direction=direction, amount=amount, to_account_id=to_account_id)
+        # Start transaction, start over if an account changed after it was read
+        for _ in range(settings.PAYMENT_OPTIMISTIC_RETRIES + 1):
+            try:
+                if alias != to_alias:
+                    return cls.two_phase_transaction([alias, to_alias], **payment_data)
+                with transaction.atomic(using=alias):
+                    return cls.transfer(**payment_data)
+            except AccountVersionConflict:
+                continue
+            # On exception transaction already have been rolled back safely
+            except (IntegrityError, TransactionManagementError, DatabaseError):
+                raise errors.AccountPaymentTransactionError
+        raise errors.AccountPaymentTransactionError
+
+    @classmethod
+    def transfer(
+        cls, *, account_id: int, direction: DirectionType, amount: Decimal, to_account_id: int, notify: bool = True
+    ) -> Payment:
+        """Move money, call in transaction on the shards of both accounts."""
+        if settings.PAYMENT_CONCURRENCY == LOCKING:
+            credit_account, deposit_account = cls.move_locking(account_id, direction, amount, to_account_id)
+        elif settings.PAYMENT_CONCURRENCY == OPTIMISTIC:
+            credit_account, deposit_account = cls.move_optimistic(account_id, direction, amount, to_account_id)
+        else:
+            raise ImproperlyConfigured(f"Unknown PAYMENT_CONCURRENCY {settings.PAYMENT_CONCURRENCY!r}.")
+        # Create payment
+        payment = Payment.objects.using(shard_for_id(account_id)).create(
+            account_id=account_id, direction=direction, amount=amount, to_account_id=to_account_id
+        )
+        # Update turnover statistics
+        TurnoverRollup.record(payment, credit_account, deposit_account)
+        # Publish payment event on commit
+        events.record(payment, notify=notify)
+        return payment
+
+    @classmethod
+    def move_locking(
+        cls, account_id: int, direction: DirectionType, amount: Decimal, to_account_id: int
+    ) -> Tuple[Account, Account]:
+        """Lock both accounts, check and change balances."""
+        # Lock two rows in id order, deadlocks across shards are not detected
+        locked = {pk: cls.select_for_update(pk) for pk in sorted([account_id, to_account_id])}
+        account1, account2 = locked[account_id], locked[to_account_id]
+        # Determine payment direction
+        credit_account, deposit_account = cls.determine_direction(direction, account1, account2)
+        # Check balance and currency
+        cls.check_balance(credit_account, amount)
+        cls.check_currency(credit_account, deposit_account)
+        # Change money
+        credit_account.balance = F("balance") - amount
+        deposit_account.balance = F("balance") + amount
+        for account in (credit_account, deposit_account):
+            account.version = F("version") + 1
+            account.save(update_fields=["balance", "version"])
+        return credit_account, deposit_account
+
+    @classmethod
+    def move_optimistic(
+        cls, account_id: int, direction: DirectionType, amount: Decimal, to_account_id: int
+    ) -> Tuple[Account, Account]:
+        """Check accounts without locks, change balances if still unchanged.
+
+        The credit update is conditional on the version read, a deposit
+        can not break any check. Raise `AccountVersionConflict` when the
+        credit account changed, the caller starts over.
         """
-        # Start transaction
+        account1 = Account.objects.using(shard_for_id(account_id)).get(id=account_id)
+        account2 = Account.objects.using(shard_for_id(to_account_id)).get(id=to_account_id)
+        # Determine payment direction
+        credit_account, deposit_account = cls.determine_direction(direction, account1, account2)
+        # Check balance and currency
+        cls.check_balance(credit_account, amount)
+        cls.check_currency(credit_account, deposit_account)
+        # Change money, rows in id order as in locking mode
+        for account in sorted([credit_account, deposit_account], key=lambda account: account.id):
+            accounts = Account.objects.using(shard_for_id(account.id)).filter(id=account.id)
+            if account is deposit_account:
+                accounts.update(balance=F("balance") + amount, version=F("version") + 1)
+            elif not accounts.filter(version=account.version, balance__gte=amount).update(
+                balance=F("balance") - amount, version=F("version") + 1
+            ):
+                raise AccountVersionConflict
+        return credit_account, deposit_account
+
+    @classmethod
+    def two_phase_transaction(cls, aliases: List[str], **payment_data) -> Payment:
+        """Cross-shard payment with two-phase commit.
+
+        Both shards prepare the transaction, the decision row on the first
+        shard is the commit point. If the process dies in between or the
+        decision row can not be written, `manage.py recover_transfers`
+        finishes in-doubt transactions. The first decision row wins: a
+        payment late after recovery claimed `abort` fails.
+        Prepared transactions can not NOTIFY, the events listener finds
+        the payment event on its next poll.
+        """
+        for alias in aliases:
+            if connections[alias].in_atomic_block:
+                raise TransactionManagementError("Cross-shard payment can not run in an outer transaction.")
+        gid = f"{TWO_PHASE_PREFIX}{uuid4().hex}"
+        payment = cls.prepare(aliases, gid, **payment_data)
+        # Commit point, once attempted never roll back here: the row may be
+        # written whatever the error, `recover` finishes an unknown decision
+        outcome = cls.decide(gid)
+        if outcome is None:
+            raise errors.AccountPaymentInDoubtError
+        if outcome == ABORT:
+            cls.finish_prepared(aliases, gid, commit=False)
+            raise errors.AccountPaymentTransactionError
+        cls.commit_prepared(aliases, gid, payment)
+        return payment
+
+    @classmethod
+    def prepare(cls, aliases: List[str], gid: str, **payment_data) -> Payment:
+        """Make payment and prepare its transaction on the shards."""
+        prepared = []
         try:
-            with transaction.atomic():
-                # Lock two rows
-                account1 = cls.select_for_update(account_id)
-                account2 = cls.select_for_update(to_account_id)
-                # Determine payment direction
-                credit_account, deposit_account = cls.determine_direction(direction, account1, account2)
-                # Check balance and currency
-                cls.check_balance(credit_account, amount)
-                cls.check_currency(credit_account, deposit_account)
-                # Change money
-                credit_account.balance = F("balance") - amount
-                deposit_account.balance = F("balance") + amount
-                credit_account.save(update_fields=["balance"])
-                deposit_account.save(update_fields=["balance"])
-                # Create payment
-                payment = Payment.objects.create(
-                    account_id=account_id, direction=direction, amount=amount, to_account_id=to_account_id
-                )
-                return payment
-        # On exception transaction already have been rolled back safely
-        except (IntegrityError, TransactionManagementError, DatabaseError):
+            with ExitStack() as stack:
+                for alias in aliases:
+                    stack.enter_context(transaction.atomic(using=alias))
+                payment = cls.transfer(notify=False, **payment_data)
+                for alias in aliases:
+                    with connections[alias].cursor() as cur:
+                        cur.execute("PREPARE TRANSACTION %s", [gid])
+                    prepared.append(alias)
+        except BaseException:
+            cls.finish_prepared(prepared, gid, commit=False)
+            raise
+        return payment
+
+    @classmethod
+    def commit_prepared(cls, aliases: List[str], gid: str, payment: Payment) -> None:
+        """Commit decided payment, fail if it is already rolled back.
+
+        Left prepared it is committed by `recover`. Gone, it was finished by
+        `recover`: committed, or rolled back before an `abort` row expired.
+        """
+        if all(cls.finish_prepared(aliases, gid, commit=True)):
+            with connections[settings.SHARDS[0]].cursor() as cur:
+                cur.execute("DELETE FROM payment_transfer_decision WHERE gid = %s", [gid])
+            return
+        try:
+            rolled_back = cls.rolled_back(aliases[0], gid, payment)
+        except DatabaseError:
+            raise errors.AccountPaymentInDoubtError
+        if rolled_back:
             raise errors.AccountPaymentTransactionError
 
+    @classmethod
+    def decide(cls, gid: str) -> Optional[str]:
+        """Claim commit decision, retry once on a new connection.
+
+        Return the decision, `abort` if recovery was first, None when the
+        decision is unknown.
+        """
+        for _ in range(2):
+            try:
+                return cls.claim(gid, COMMIT)
+            except DatabaseError:
+                logger.exception("Can not write decision of prepared transaction %s", gid)
+                connections[settings.SHARDS[0]].close()
+        return None
+
+    @staticmethod
+    def claim(gid: str, outcome: str) -> str:
+        """Write decision unless there is one, return the decision.
+
+        Two statements: a conflicting row committed during the insert is
+        not visible in its snapshot.
+        """
+        with connections[settings.SHARDS[0]].cursor() as cur:
+            cur.execute(
+                "INSERT INTO payment_transfer_decision (gid, outcome) VALUES (%s, %s) ON CONFLICT (gid) DO NOTHING",
+                [gid, outcome],
+            )
+            cur.execute("SELECT outcome FROM payment_transfer_decision WHERE gid = %s", [gid])
+            return cur.fetchone()[0]
+
+    @staticmethod
+    def rolled_back(alias: str, gid: str, payment: Payment) -> bool:
+        """Check transaction is gone from the payment shard, without it."""
+        with connections[alias].cursor() as cur:
+            cur.execute(
+                "SELECT EXISTS (SELECT FROM pg_prepared_xacts WHERE database = current_database() AND gid = %s)", [gid]
+            )
+            if cur.fetchone()[0]:
+                return False
+        return not Payment.objects.using(alias).filter(id=payment.id).exists()
+
+    @staticmethod
+    def finish_prepared(aliases: List[str], gid: str, commit: bool) -> List[bool]:
+        """Commit or roll back prepared transaction on shards.
+
+        Failures are left for `recover`, the decision is already made.
+        """
+        statement = "COMMIT PREPARED %s" if commit else "ROLLBACK PREPARED %s"
+        finished = []
+        for alias in aliases:
+            try:
+                with connections[alias].cursor() as cur:
+                    cur.execute(statement, [gid])
+                finished.append(True)
+            except DatabaseError:
+                logger.exception("Can not finish prepared transaction %s on %s", gid, alias)
+                finished.append(False)
+        return finished
+
+    @classmethod
+    def recover(cls, grace: int) -> List[Tuple[str, str, bool]]:
+        """Finish in-doubt cross-shard payments prepared grace seconds ago.
+
+        Commit on a `commit` decision. Without a decision claim `abort`
+        first, so a late payment can not commit after the rollback.
+        Return (gid, shard, committed) of finished transactions.
+        """
+        coordinator = connections[settings.SHARDS[0]]
+        finished, pending = [], set()
+        for alias in settings.SHARDS:
+            with connections[alias].cursor() as cur:
+                cur.execute(
+                    """
+                    SELECT gid, prepared < now() - make_interval(secs => %s) FROM pg_prepared_xacts
+                    WHERE database = current_database() AND gid LIKE %s
+                    """,
+                    [grace, f"{TWO_PHASE_PREFIX}%"],
+                )
+                rows = cur.fetchall()
+            for gid, expired in rows:
+                commit = expired and cls.claim(gid, ABORT) == COMMIT
+                if expired and cls.finish_prepared([alias], gid, commit=commit)[0]:
+                    finished.append((gid, alias, commit))
+                else:
+                    pending.add(gid)
+        # Forget decisions with nothing left to commit
+        with coordinator.cursor() as cur:
+            cur.execute(
+                """
+                DELETE FROM payment_transfer_decision
+                WHERE created_at < now() - make_interval(secs => %s) AND NOT gid = ANY(%s)
+                """,
+                [grace, list(pending)],
+            )
+        return finished
+
     @classmethod
     def select_for_update(cls, account_id: int) -> Account:
         """Read and write lock row in table account."""
-        return Account.objects.select_for_update().get(id=account_id)
+        return Account.objects.using(shard_for_id(account_id)).select_for_update().get(id=account_id)
 
     @classmethod
     def determine_direction(cls, direction: DirectionType, account1: int, account2: int) -> Tuple[Account, Account]:
@@ -87,3 +335,145 @@ class AccountPayment:
         """Check currency of two accounts."""
         if credit_account.currency != deposit_account.currency:
             raise errors.AccountCurrencyError
+
+
+class AccountSearch:
+    """Find accounts by name.
+
+    Exact names live on one shard and are backed by the UNIQUE index.
+    """
+
+    # Shorter queries have no trigrams, the similarity index would match all
+    SEARCH_MIN_LENGTH = 3
+
+    @classmethod
+    def exact(cls, name: str) -> Optional[Account]:
+        """Account with exactly this name.
+
+        One unique index lookup. Not cached: the balance changes with every
+        payment, so a cache could save the round trip only for stale data.
+        """
+        return Account.objects.using(shard_for_name(name)).filter(name=name).first()
+
+    @classmethod
+    def search(cls, query: str) -> Union[QuerySet, ShardedQuerySet]:
+        """Accounts which name starts with or is similar to query, all shards.
+
+        Backed by `idx_account_name` (prefix) and `idx_account_name_trgm`
+        (pg_trgm similarity) indexes.
+        """
+        if len(query) < cls.SEARCH_MIN_LENGTH:
+            raise errors.AccountSearchError
+        queryset = Account.objects.filter(Q(name__startswith=query) | Q(name__trigram_similar=query))
+        return ShardedQuerySet.from_queryset(queryset)
+
+
+class TurnoverRollup:
+    """Turnover statistics by day and month.
+
+    Rollups are updated in the payment transaction, so reading statistics
+    never touches the `payment` table and costs the same for any history size.
+    """
+
+    ACCOUNT_SQL = """
+        INSERT INTO account_turnover AS t
+          (account_id, period, period_start, incoming_count, incoming_amount, outgoing_count, outgoing_amount)
+        VALUES {values}
+        ON CONFLICT (account_id, period, period_start) DO UPDATE SET
+          incoming_count = t.incoming_count + EXCLUDED.incoming_count,
+          incoming_amount = t.incoming_amount + EXCLUDED.incoming_amount,
+          outgoing_count = t.outgoing_count + EXCLUDED.outgoing_count,
+          outgoing_amount = t.outgoing_amount + EXCLUDED.outgoing_amount
+    """
+    CURRENCY_SQL = """
+        INSERT INTO currency_turnover AS t
+          (currency, period, period_start, stripe, incoming_count, incoming_amount, outgoing_count, outgoing_amount)
+        VALUES {values}
+        ON CONFLICT (currency, period, period_start, stripe) DO UPDATE SET
+          incoming_count = t.incoming_count + EXCLUDED.incoming_count,
+          incoming_amount = t.incoming_amount + EXCLUDED.incoming_amount,
+          outgoing_count = t.outgoing_count + EXCLUDED.outgoing_count,
+          outgoing_amount = t.outgoing_amount + EXCLUDED.outgoing_amount
+    """
+
+    @classmethod
+    def record(cls, payment: Payment, credit_account: Account, deposit_account: Account) -> None:
+        """Add payment to account and currency rollups.
+
+        Must be called in the payment transaction, after both accounts are
+        locked: account rollup rows are then never contended on their own.
+        """
+        amount = payment.amount
+        periods = cls.periods(payment.created_at.date())
+        credit_rows = [(credit_account.id, period, start, 0, 0, 1, amount) for period, start in periods]
+        deposit_rows = [(deposit_account.id, period, start, 1, amount, 0, 0) for period, start in periods]
+        incoming = payment.direction == Payment.INCOMING
+        stripe = credit_account.id % TURNOVER_STRIPES
+        currency_rows = [
+            (credit_account.currency, period, period_start, stripe, *cls.directed(incoming, amount))
+            for period, period_start in periods
+        ]
+        # Every account rollup lives on the shard of its account
+        credit_alias, deposit_alias = shard_for_id(credit_account.id), shard_for_id(deposit_account.id)
+        if credit_alias == deposit_alias:
+            credit_rows, deposit_rows = credit_rows + deposit_rows, []
+        with connections[credit_alias].cursor() as cur:
+            cls.upsert(cur, cls.ACCOUNT_SQL, credit_rows)
+            cls.upsert(cur, cls.CURRENCY_SQL, currency_rows)
+        if deposit_rows:
+            with connections[deposit_alias].cursor() as cur:
+                cls.upsert(cur, cls.ACCOUNT_SQL, deposit_rows)
+
+    @staticmethod
+    def periods(day: date) -> List[Tuple[str, date]]:
+        """Rollup periods which contain the day."""
+        return [(Turnover.DAY, day), (Turnover.MONTH, day.replace(day=1))]
+
+    @staticmethod
+    def directed(incoming: bool, amount: Decimal) -> Tuple[int, Decimal, int, Decimal]:
+        """Turnover counters of one payment."""
+        if incoming:
+            return 1, amount, 0, Decimal(0)
+        return 0, Decimal(0), 1, amount
+
+    @staticmethod
+    def upsert(cur, sql: str, rows: List[tuple]) -> None:
+        """Insert or increment rollup rows in one statement."""
+        row = "({})".format(", ".join(["%s"] * len(rows[0])))
+        cur.execute(sql.format(values=", ".join([row] * len(rows))), [value for values in rows for value in values])
+
+    @classmethod
+    def period_range(cls, period: str, start: date, end: date) -> Tuple[date, date]:
+        """Align range to period starts."""
+        if period == Turnover.MONTH:
+            return start.replace(day=1), end.replace(day=1)
+        return start, end
+
+    @classmethod
+    def account(cls, account_id: int, period: str, start: date, end: date) -> QuerySet:
+        """Account turnover by period."""
+        start, end = cls.period_range(period, start, end)
+        return AccountTurnover.objects.using(shard_for_id(account_id)).filter(
+            account_id=account_id, period=period, period_start__range=(start, end)
+        )
+
+    @classmethod
+    def currency(cls, period: str, start: date, end: date, currency: Optional[str] = None) -> List[dict]:
+        """Currency turnover by period, summed over stripes and shards."""
+        start, end = cls.period_range(period, start, end)
+        queryset = CurrencyTurnover.objects.filter(period=period, period_start__range=(start, end))
+        if currency:
+            queryset = queryset.filter(currency=currency)
+        queryset = queryset.values("currency", "period_start").annotate(
+            **{f"{field}_sum": Sum(field) for field in TURNOVER_FIELDS}
+        )
+        totals = {}
+        for rows in on_shards(lambda alias: list(queryset.using(alias))):
+            for row in rows:
+                key = (row["currency"], row["period_start"])
+                total = totals.setdefault(
+                    key, dict(currency=key[0], period_start=key[1], **{field: 0 for field in TURNOVER_FIELDS})
+                )
+                for field in TURNOVER_FIELDS:
+                    total[field] += row[f"{field}_sum"]
+        return [totals[key] for key in sorted(totals)]
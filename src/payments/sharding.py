@@ -0,0 +1,174 @@
+"""Horizontal sharding of accounts.
+
+Every shard is a database alias from `settings.SHARDS` with the same schema.
+Account and payment ids are interleaved between shards (SQL function
+`configure_shard`), so the shard of an id is `(id - 1) % len(SHARDS)`.
+New accounts are placed by name hash, so name uniqueness and name lookups
+stay on one shard. Payments are stored on the shard of `account_id`.
+"""
+
+import heapq
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from functools import cmp_to_key, lru_cache
+from itertools import islice
+from typing import Callable, Dict, List, TypeVar, Union
+
+from django.conf import settings
+from django.core import checks
+from django.db import close_old_connections, connections
+from django.db.models import QuerySet
+
+T = TypeVar("T")  # pylint: disable=C0103
+
+
+def is_sharded() -> bool:
+    """Check there is more than one shard."""
+    return len(settings.SHARDS) > 1
+
+
+def shard_for_id(object_id: Union[int, str]) -> str:
+    """Shard of account or payment id, ValueError for bad ids."""
+    return settings.SHARDS[(int(object_id) - 1) % len(settings.SHARDS)]
+
+
+def shard_for_name(name: str) -> str:
+    """Shard of account name."""
+    return settings.SHARDS[zlib.crc32(name.encode()) % len(settings.SHARDS)]
+
+
+def check_shards(app_configs=None, **kwargs) -> List[checks.CheckMessage]:  # pylint: disable=W0613
+    """System check: id sequences of every shard match its position.
+
+    Without `configure_shard` every shard hands out ids 1, 2, 3... which
+    `shard_for_id` maps to other shards. Runs with `migrate`, `check --tag
+    database` and on gunicorn start.
+    """
+    if not is_sharded():
+        return []
+    errors = []
+    for shard, alias in enumerate(settings.SHARDS):
+        for sequence in ("account_id_seq", "payment_id_seq"):
+            with connections[alias].cursor() as cur:
+                cur.execute(
+                    f"""
+                    SELECT increment_by, CASE WHEN is_called THEN seq.last_value + increment_by ELSE seq.last_value END
+                    FROM {sequence} seq, pg_sequences
+                    WHERE schemaname = current_schema() AND sequencename = %s
+                    """,
+                    [sequence],
+                )
+                increment, next_id = cur.fetchone()
+            if increment != len(settings.SHARDS) or (next_id - 1) % len(settings.SHARDS) != shard:
+                errors.append(
+                    checks.Error(
+                        f"Sequence {sequence} of {alias} does not hand out ids of shard {shard}.",
+                        hint="Run `python manage.py configure_shards`.",
+                        id="payments.E001",
+                    )
+                )
+    return errors
+
+
+@lru_cache(maxsize=None)
+def executor(alias: str) -> ThreadPoolExecutor:
+    """Thread pool for queries of one shard.
+
+    One thread per concurrent request (`SHARD_POOL_SIZE`), so requests do
+    not queue behind each other. Threads connect to their shard only.
+    """
+    return ThreadPoolExecutor(max_workers=settings.SHARD_POOL_SIZE, thread_name_prefix=f"shard-{alias}")
+
+
+def on_shard(func: Callable[[str], T], alias: str) -> T:
+    """Call func in a pool thread, the thread owns its connections.
+
+    Connections follow `CONN_MAX_AGE`, as in request threads.
+    """
+    close_old_connections()
+    try:
+        return func(alias)
+    finally:
+        close_old_connections()
+
+
+def on_shards(func: Callable[[str], T]) -> List[T]:
+    """Call func(alias) for every shard in parallel.
+
+    Inside a transaction run in this thread: pool threads have their own
+    connections and can not see uncommitted rows.
+    """
+    if not is_sharded() or any(connections[alias].in_atomic_block for alias in settings.SHARDS):
+        return [func(alias) for alias in settings.SHARDS]
+    futures = [executor(alias).submit(on_shard, func, alias) for alias in settings.SHARDS]
+    return [future.result() for future in futures]
+
+
+class ShardedQuerySet:
+    """Read only queryset over all shards.
+
+    Enough of the QuerySet API for DRF pagination: `filter`, `order_by`,
+    `count` and slicing. Slices are read from every shard in parallel and
+    merged by ordering.
+    """
+
+    ordered = True
+
+    def __init__(self, querysets: Dict[str, QuerySet]):
+        self.querysets = querysets
+        self.model = next(iter(querysets.values())).model
+
+    @classmethod
+    def from_queryset(cls, queryset: QuerySet) -> Union[QuerySet, "ShardedQuerySet"]:
+        """Spread queryset over shards, as is without sharding."""
+        if not is_sharded():
+            return queryset
+        return cls({alias: queryset.using(alias) for alias in settings.SHARDS})
+
+    def _map(self, method: str, *args, **kwargs) -> "ShardedQuerySet":
+        return type(self)({alias: getattr(qs, method)(*args, **kwargs) for alias, qs in self.querysets.items()})
+
+    def all(self) -> "ShardedQuerySet":
+        """Copy."""
+        return self._map("all")
+
+    def filter(self, *args, **kwargs) -> "ShardedQuerySet":
+        """Filter on every shard."""
+        return self._map("filter", *args, **kwargs)
+
+    def exclude(self, *args, **kwargs) -> "ShardedQuerySet":
+        """Exclude on every shard."""
+        return self._map("exclude", *args, **kwargs)
+
+    def order_by(self, *fields) -> "ShardedQuerySet":
+        """Order on every shard."""
+        return self._map("order_by", *fields)
+
+    def count(self) -> int:
+        """Sum of shard counts."""
+        return sum(on_shards(lambda alias: self.querysets[alias].count()))
+
+    def __len__(self) -> int:
+        return self.count()
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __getitem__(self, key: slice) -> list:
+        """Merged slice, every shard reads up to `key.stop` rows."""
+        if not isinstance(key, slice) or key.step:
+            raise TypeError("ShardedQuerySet supports plain slices only.")
+        rows = on_shards(lambda alias: list(self.querysets[alias][: key.stop]))
+        merged = heapq.merge(*rows, key=cmp_to_key(self.compare))
+        return list(islice(merged, key.start or 0, key.stop))
+
+    def compare(self, obj1, obj2) -> int:
+        """Compare two rows by queryset ordering."""
+        queryset = next(iter(self.querysets.values()))
+        for field in queryset.query.order_by or self.model._meta.ordering:  # pylint: disable=W0212
+            name = field.lstrip("-")
+            value1, value2 = getattr(obj1, name), getattr(obj2, name)
+            if value1 != value2:
+                result = -1 if value1 < value2 else 1
+                return -result if field.startswith("-") else result
+        return 0
@@ -1,25 +1,50 @@
 """API tests."""
 
+import json
+import os
+import subprocess
+import sys
+import threading
+from datetime import date
 from decimal import Decimal
+from itertools import count
+from unittest import skipIf, skipUnless
 from unittest.mock import patch
 
-from django.db import transaction
-from django.test import Client, TestCase, TransactionTestCase
+import psycopg2
+from django.conf import settings
+from django.db import DatabaseError, OperationalError, connection, connections, transaction
+from django.db.models import F
+from django.test import Client, TestCase, TransactionTestCase, override_settings
 
 from payments import errors
-from payments.models import Account, Payment
-from payments.service import AccountPayment
+from payments.events import EventHub
+from payments.models import Account, AccountTurnover, Payment, Turnover
+from payments.service import ABORT, AccountPayment, TurnoverRollup
+from payments.sharding import check_shards, executor, is_sharded, on_shards, shard_for_id, shard_for_name
+
+
+def create_account(**kwargs) -> Account:
+    """Create account on the shard of its name."""
+    return Account.objects.using(shard_for_name(kwargs["name"])).create(**kwargs)
+
+
+def get_account(account_id: int) -> Account:
+    """Read account from its shard."""
+    return Account.objects.using(shard_for_id(account_id)).get(id=account_id)
 
 
 class TestBase:
     """Base test class."""
 
+    databases = "__all__"
+
     @classmethod
     def setUpTestData(cls):  # pylint: disable=C0103
         """Create some data for tests."""
-        cls.account_usd1 = Account.objects.create(name="account_usd1", balance=Decimal("300"), currency=Account.USD)
-        cls.account_usd2 = Account.objects.create(name="account_usd2", balance=Decimal("100"), currency=Account.USD)
-        cls.account_uah1 = Account.objects.create(name="account_uah1", balance=Decimal("100"), currency=Account.UAH)
+        cls.account_usd1 = create_account(name="account_usd1", balance=Decimal("300"), currency=Account.USD)
+        cls.account_usd2 = create_account(name="account_usd2", balance=Decimal("100"), currency=Account.USD)
+        cls.account_uah1 = create_account(name="account_uah1", balance=Decimal("100"), currency=Account.UAH)
 
     def setUp(self):  # pylint: disable=C0103
         """Create request client."""
@@ -61,12 +86,122 @@ class TestAccountAPI(TestBase, TestCase):
         )
         self.assertEqual(response.status_code, 400)
 
+    def test_api_get_account_etag(self):
+        """Test API endpoint GET `/api/v1/accounts/<id>/` conditional."""
+        url = f"/api/v1/accounts/{self.account_usd1.id}/"
+        etag = self.client.get(url)["ETag"]
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+        # Balance changed
+        AccountPayment.transaction(
+            account_id=self.account_usd1.id,
+            direction=Payment.OUTGOING,
+            amount=Decimal("10"),
+            to_account_id=self.account_usd2.id,
+        )
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(response.json()["balance"], Decimal("290"))
+
     def test_api_put_account(self):
         """Test API PUT."""
         response = self.client.put(f"/api/v1/accounts/{self.account_usd1.id}/", {"name": "test"})
         self.assertEqual(response.status_code, 405)
 
 
+class TestAccountSearchAPI(TestBase, TestCase):
+    """Test account search API endpoints."""
+
+    def test_api_get_account_by_name(self):
+        """Test API endpoint GET `/api/v1/accounts/?name=`."""
+        response = self.client.get("/api/v1/accounts/", {"name": "account_usd2"})
+        self.assertEqual(response.status_code, 200)
+        results = response.json()["results"]
+        self.assertEqual([account["id"] for account in results], [self.account_usd2.id])
+
+    def test_api_get_account_by_name_neg(self):
+        """Test API endpoint GET `/api/v1/accounts/?name=` unknown name."""
+        response = self.client.get("/api/v1/accounts/", {"name": "account_usd"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["results"], [])
+
+    def test_api_search_account_prefix(self):
+        """Test API endpoint GET `/api/v1/accounts/?search=` by prefix."""
+        response = self.client.get("/api/v1/accounts/", {"search": "account_usd"})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("count", response.json())
+        names = [account["name"] for account in response.json()["results"]]
+        self.assertEqual(names, ["account_usd1", "account_usd2"])
+
+    def test_api_search_account_neg(self):
+        """Test API endpoint GET `/api/v1/accounts/?search=` short query."""
+        response = self.client.get("/api/v1/accounts/", {"search": "ac"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_api_search_account_similar(self):
+        """Test API endpoint GET `/api/v1/accounts/?search=` by similarity."""
+        response = self.client.get("/api/v1/accounts/", {"search": "acount_uah1"})
+        self.assertEqual(response.status_code, 200)
+        names = [account["name"] for account in response.json()["results"]]
+        self.assertIn("account_uah1", names)
+
+
+class TestApiProfile(TestCase):
+    """Test API endpoints with API-only settings profile.
+
+    Settings are read at import time, so the profile boots in a child
+    interpreter against the test database.
+    """
+
+    SMOKE = """
+import json
+
+import django
+from django.conf import settings
+from django.test import Client
+
+django.setup()
+response = Client().get("/api/v1/accounts/", HTTP_ACCEPT="text/html,*/*;q=0.8")
+print(json.dumps({
+    "status": response.status_code,
+    "content_type": response["Content-Type"],
+    "x_frame_options": response.has_header("X-Frame-Options"),
+    "cookies": bool(response.cookies),
+    "apps": settings.INSTALLED_APPS,
+    "templates": settings.TEMPLATES,
+}))
+"""
+
+    def test_api_get_account(self):
+        """Test API endpoint GET `/api/v1/accounts/` without browser stack."""
+        env = dict(
+            os.environ,
+            DJANGO_SETTINGS_MODULE="accounts.settings_api",
+            DJANGO_ALLOWED_HOSTS="testserver",
+            POSTGRES_DB=connection.settings_dict["NAME"],
+            POSTGRES_SHARDS="",
+        )
+        out = subprocess.run(
+            [sys.executable, "-c", self.SMOKE],
+            env=env,
+            cwd=settings.BASE_DIR,
+            check=True,
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+        )
+        result = json.loads(out.stdout)
+        self.assertEqual(result["status"], 200)
+        # No browsable API even for browsers
+        self.assertEqual(result["content_type"], "application/json")
+        self.assertFalse(result["x_frame_options"])
+        self.assertFalse(result["cookies"])
+        self.assertNotIn("django.contrib.admin", result["apps"])
+        self.assertEqual(result["templates"], [])
+
+
 class TestPaymentAPI(TestBase, TestCase):
     """Test payment API endpoints."""
 
@@ -201,6 +336,88 @@ class TestPaymentAPI(TestBase, TestCase):
         self.assertEqual(response2.status_code, 405)
 
 
+class TestStatsAPI(TestBase, TestCase):
+    """Test turnover statistics API endpoints."""
+
+    def setUp(self):  # pylint: disable=C0103
+        """Make some payments.
+
+        account_usd1: -100 -50 +30
+        account_usd2: +100 +50 -30
+        """
+        super().setUp()
+        for direction, amount in ((Payment.OUTGOING, "100"), (Payment.OUTGOING, "50"), (Payment.INCOMING, "30")):
+            AccountPayment.transaction(
+                account_id=self.account_usd1.id,
+                direction=direction,
+                amount=Decimal(amount),
+                to_account_id=self.account_usd2.id,
+            )
+
+    def test_api_get_account_stats(self):
+        """Test API endpoint GET `/api/v1/accounts/id/stats/`."""
+        for period in ("day", "month"):
+            response = self.client.get(f"/api/v1/accounts/{self.account_usd1.id}/stats/", {"period": period})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()["currency"], Account.USD)
+            (turnover,) = response.json()["results"]
+            self.assertEqual(turnover["incoming_count"], 1)
+            self.assertEqual(turnover["incoming_amount"], Decimal("30"))
+            self.assertEqual(turnover["outgoing_count"], 2)
+            self.assertEqual(turnover["outgoing_amount"], Decimal("150"))
+
+        response = self.client.get(f"/api/v1/accounts/{self.account_usd2.id}/stats/")
+        (turnover,) = response.json()["results"]
+        self.assertEqual(turnover["incoming_amount"], Decimal("150"))
+        self.assertEqual(turnover["outgoing_amount"], Decimal("30"))
+
+    def test_api_get_account_stats_neg(self):
+        """Test API endpoint GET `/api/v1/accounts/id/stats/` bad queries."""
+        response = self.client.get(f"/api/v1/accounts/{self.account_usd1.id}/stats/", {"period": "year"})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(
+            f"/api/v1/accounts/{self.account_usd1.id}/stats/", {"start": "2020-02-01", "end": "2020-01-01"}
+        )
+        self.assertEqual(response.status_code, 400)
+        # Unbounded history
+        response = self.client.get(f"/api/v1/accounts/{self.account_usd1.id}/stats/", {"start": "0001-01-01"})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get("/api/v1/stats/", {"period": "month", "start": "2000-01-01", "end": "2020-01-01"})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get("/api/v1/stats/", {"start": "2020-01-01", "end": "2020-12-31"})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get("/api/v1/accounts/0/stats/")
+        self.assertEqual(response.status_code, 404)
+
+    def test_api_get_stats(self):
+        """Test API endpoint GET `/api/v1/stats/`."""
+        response = self.client.get("/api/v1/stats/", {"period": "month", "currency": Account.USD})
+        self.assertEqual(response.status_code, 200)
+        (turnover,) = response.json()["results"]
+        self.assertEqual(turnover["currency"], Account.USD)
+        self.assertEqual(turnover["incoming_count"], 1)
+        self.assertEqual(turnover["incoming_amount"], Decimal("30"))
+        self.assertEqual(turnover["outgoing_count"], 2)
+        self.assertEqual(turnover["outgoing_amount"], Decimal("150"))
+
+        response = self.client.get("/api/v1/stats/", {"currency": Account.UAH})
+        self.assertEqual(response.json()["results"], [])
+
+    @skipIf(is_sharded(), "rebuild_turnover refuses to run on shards")
+    def test_rebuild_turnover(self):
+        """Test SQL function `rebuild_turnover` matches incremental rollups."""
+        fields = ("period", "period_start", "incoming_count", "incoming_amount", "outgoing_count", "outgoing_amount")
+        start, end = date.min, date.max
+        account_rollups = set(AccountTurnover.objects.values_list("account_id", *fields))
+        # Currency rollups are striped, compare sums over stripes
+        currency_rollups = TurnoverRollup.currency(Turnover.DAY, start, end)
+        self.assertTrue(currency_rollups)
+        with connection.cursor() as cur:
+            cur.execute("SELECT rebuild_turnover()")
+        self.assertEqual(set(AccountTurnover.objects.values_list("account_id", *fields)), account_rollups)
+        self.assertEqual(TurnoverRollup.currency(Turnover.DAY, start, end), currency_rollups)
+
+
 class TestAccountPayment(TestBase, TransactionTestCase):
     """Test account payment transaction."""
 
@@ -227,8 +444,418 @@ class TestAccountPayment(TestBase, TransactionTestCase):
 
         with self.assertRaises(errors.AccountPaymentTransactionError):
             with patch.object(AccountPayment, "check_balance", return_value=None):
-                with transaction.atomic():
+                with transaction.atomic(using=shard_for_id(self.account_usd1.id)):
                     AccountPayment.transaction(**payment1)
                     AccountPayment.transaction(**payment2)
         # Account balance must not be changed
-        self.assertEqual(self.account_usd1.balance, Account.objects.get(id=self.account_usd1.id).balance)
+        self.assertEqual(self.account_usd1.balance, get_account(self.account_usd1.id).balance)
+
+
+@override_settings(PAYMENT_CONCURRENCY="optimistic")
+class TestOptimisticPayment(TestBase, TestCase):
+    """Test account payment transaction in optimistic mode."""
+
+    def pay(self, amount):
+        """Make payment account_usd1 -> account_usd2."""
+        return AccountPayment.transaction(
+            account_id=self.account_usd1.id,
+            direction=Payment.OUTGOING,
+            amount=Decimal(amount),
+            to_account_id=self.account_usd2.id,
+        )
+
+    def concurrent_payment(self, *args):  # pylint: disable=W0613
+        """Change account_usd1 between read and update, as another payment."""
+        accounts = Account.objects.using(shard_for_id(self.account_usd1.id))
+        accounts.filter(id=self.account_usd1.id).update(version=F("version") + 1)
+
+    def test_payment(self):
+        """Test payment changes balances and versions."""
+        self.pay("100")
+        account_usd1 = get_account(self.account_usd1.id)
+        account_usd2 = get_account(self.account_usd2.id)
+        self.assertEqual((account_usd1.balance, account_usd1.version), (Decimal("200"), 2))
+        self.assertEqual((account_usd2.balance, account_usd2.version), (Decimal("200"), 2))
+        with self.assertRaises(errors.AccountBalanceError):
+            self.pay("1000")
+
+    def test_payment_conflict(self):
+        """Test payment starts over after a conflict."""
+        with patch.object(AccountPayment, "check_balance") as check:
+            # Conflict on the first attempt only
+            check.side_effect = lambda *args: self.concurrent_payment() if check.call_count == 1 else None
+            self.pay("100")
+        self.assertEqual(check.call_count, 2)
+        self.assertEqual(get_account(self.account_usd1.id).balance, Decimal("200"))
+
+    def test_payment_conflict_neg(self):
+        """Test payment gives up after too many conflicts."""
+        with patch.object(AccountPayment, "check_balance", side_effect=self.concurrent_payment) as check:
+            with self.assertRaises(errors.AccountPaymentTransactionError):
+                self.pay("100")
+        self.assertEqual(check.call_count, settings.PAYMENT_OPTIMISTIC_RETRIES + 1)
+        self.assertEqual(get_account(self.account_usd1.id).balance, Decimal("300"))
+
+
+class TestPaymentEventAPI(TransactionTestCase):
+    """Test payment events API endpoints.
+
+    Events are visible after commit only, so no transaction wrapped tests.
+    """
+
+    databases = "__all__"
+
+    @classmethod
+    def setUpClass(cls):
+        """Create some data for tests."""
+        super().setUpClass()
+        cls.account_usd1 = create_account(name="event_usd1", balance=Decimal("300"), currency=Account.USD)
+        cls.account_usd2 = create_account(name="event_usd2", balance=Decimal("100"), currency=Account.USD)
+        cls.account_uah1 = create_account(name="event_uah1", balance=Decimal("100"), currency=Account.UAH)
+
+    @classmethod
+    def tearDownClass(cls):
+        """Stop events listener."""
+        EventHub.shutdown()
+        super().tearDownClass()
+
+    def setUp(self):  # pylint: disable=C0103
+        """Create request client and remember events position."""
+        self.client = Client()
+        self.cursor = self.client.get("/api/v1/events/", {"timeout": 0}).json()["cursor"]
+
+    def pay(self, amount="10"):
+        """Make payment account_usd1 -> account_usd2."""
+        return AccountPayment.transaction(
+            account_id=self.account_usd1.id,
+            direction=Payment.OUTGOING,
+            amount=Decimal(amount),
+            to_account_id=self.account_usd2.id,
+        )
+
+    def test_api_get_events(self):
+        """Test API endpoint GET `/api/v1/events/`."""
+        payment = self.pay()
+        response = self.client.get("/api/v1/events/", {"cursor": self.cursor, "timeout": 5})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([event["id"] for event in response.json()["results"]], [payment.id])
+
+        # Resume, nothing new
+        response = self.client.get("/api/v1/events/", {"cursor": response.json()["cursor"], "timeout": 0})
+        self.assertEqual(response.json()["results"], [])
+
+    def test_api_get_events_account(self):
+        """Test API endpoint GET `/api/v1/events/` filter by account."""
+        payment = self.pay()
+        response = self.client.get(
+            "/api/v1/events/", {"cursor": self.cursor, "account": self.account_uah1.id, "timeout": 1}
+        )
+        self.assertEqual(response.json()["results"], [])
+        response = self.client.get("/api/v1/events/", {"cursor": self.cursor, "account": self.account_usd2.id})
+        self.assertEqual([event["id"] for event in response.json()["results"]], [payment.id])
+
+    def test_api_get_events_rollback(self):
+        """Test API endpoint GET `/api/v1/events/` skips failed payments."""
+        with self.assertRaises(errors.AccountBalanceError):
+            self.pay(amount="1000")
+        response = self.client.get("/api/v1/events/", {"cursor": self.cursor, "timeout": 1})
+        self.assertEqual(response.json()["results"], [])
+
+    def test_api_get_events_catch_up(self):
+        """Test API endpoint GET `/api/v1/events/` resume behind the buffer."""
+        payments = [self.pay(), self.pay()]
+        # New listener, events are in the database only
+        EventHub.shutdown()
+        response = self.client.get("/api/v1/events/", {"cursor": self.cursor, "timeout": 0})
+        self.assertEqual([event["id"] for event in response.json()["results"]], [p.id for p in payments])
+
+    def test_api_get_events_neg(self):
+        """Test API endpoint GET `/api/v1/events/` bad queries."""
+        response = self.client.get("/api/v1/events/", {"cursor": "last"})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get("/api/v1/events/", {"timeout": 55})
+        self.assertEqual(response.status_code, 400)
+
+    def test_api_stream_events(self):
+        """Test API endpoint GET `/api/v1/events/stream/`."""
+        payment = self.pay()
+        response = self.client.get("/api/v1/events/stream/", HTTP_LAST_EVENT_ID=self.cursor)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        message = next(iter(response.streaming_content)).decode()
+        response.close()
+        event_id, data = message.strip().split("\n")
+        self.assertTrue(event_id.startswith("id: "))
+        self.assertEqual(json.loads(data.split(": ", 1)[1])["id"], payment.id)
+
+
+@skipUnless(is_sharded(), "Set POSTGRES_SHARDS to test sharding.")
+class TestSharding(TransactionTestCase):
+    """Test payments between accounts on different shards."""
+
+    databases = "__all__"
+    names = count()
+
+    def setUp(self):  # pylint: disable=C0103
+        """Create request client and accounts on the first two shards."""
+        self.client = Client()
+        self.shard0, self.shard1 = settings.SHARDS[:2]
+        self.account1 = self.create_account(self.shard0, Account.USD, "300")
+        self.account2 = self.create_account(self.shard1, Account.USD, "100")
+        self.account3 = self.create_account(self.shard1, Account.USD, "100")
+
+    @classmethod
+    def tearDownClass(cls):
+        """Stop events listeners."""
+        EventHub.shutdown()
+        super().tearDownClass()
+
+    def create_account(self, alias, currency, balance):
+        """Create account through the API, with a name on the shard."""
+        name = next(name for name in map("sharded_{}".format, self.names) if shard_for_name(name) == alias)
+        response = self.client.post("/api/v1/accounts/", dict(name=name, balance=balance, currency=currency))
+        self.assertEqual(response.status_code, 201)
+        return response.json()
+
+    def balance(self, account):
+        """Account balance from the API."""
+        return Decimal(self.client.get(f"/api/v1/accounts/{account['id']}/").json()["balance"])
+
+    def pay(self, account, to_account, amount):
+        """Make payment through the API."""
+        return self.client.post(
+            "/api/v1/payments/",
+            dict(account_id=account["id"], direction=Payment.OUTGOING, amount=amount, to_account_id=to_account["id"]),
+        )
+
+    @staticmethod
+    def prepared(alias):
+        """Prepared cross-shard payment transactions on the shard."""
+        with connections[alias].cursor() as cur:
+            cur.execute(
+                "SELECT gid FROM pg_prepared_xacts WHERE database = current_database() AND gid LIKE 'payment-%%'"
+            )
+            return [gid for gid, in cur.fetchall()]
+
+    @staticmethod
+    def prepare(alias, gid, account, balance):
+        """Leave a prepared transaction, as a crashed worker does."""
+        conn = psycopg2.connect(**connections[alias].get_connection_params())
+        try:
+            with conn.cursor() as cur:
+                cur.execute("UPDATE account SET balance = %s WHERE id = %s", [balance, account["id"]])
+                cur.execute("PREPARE TRANSACTION %s", [gid])
+        finally:
+            conn.close()
+
+    def test_account_placement(self):
+        """Test accounts live on the shard of name and of id."""
+        for account, alias in [(self.account1, self.shard0), (self.account2, self.shard1)]:
+            self.assertEqual(shard_for_id(account["id"]), alias)
+            self.assertTrue(Account.objects.using(alias).filter(id=account["id"]).exists())
+            response = self.client.get("/api/v1/accounts/", {"name": account["name"]})
+            self.assertEqual(response.json()["results"][0]["id"], account["id"])
+        response = self.client.post("/api/v1/accounts/", dict(name=self.account2["name"], balance=1, currency="USD"))
+        self.assertEqual(response.status_code, 400)
+
+    def test_check_shards(self):
+        """Test system check finds a shard handing out ids of another."""
+        self.assertEqual(check_shards(), [])
+        with connections[self.shard1].cursor() as cur:
+            cur.execute("ALTER SEQUENCE payment_id_seq INCREMENT BY 1 RESTART WITH 1")
+        try:
+            self.assertEqual([error.id for error in check_shards()], ["payments.E001"])
+        finally:
+            with connections[self.shard1].cursor() as cur:
+                cur.execute("SELECT configure_shard(1, %s)", [len(settings.SHARDS)])
+        self.assertEqual(check_shards(), [])
+
+    def test_rebuild_turnover_neg(self):
+        """Test SQL function `rebuild_turnover` keeps rollups of a shard."""
+        self.pay(self.account1, self.account2, "50")
+        for alias in settings.SHARDS:
+            with self.assertRaises(DatabaseError):
+                with connections[alias].cursor() as cur:
+                    cur.execute("SELECT rebuild_turnover()")
+        response = self.client.get(f"/api/v1/accounts/{self.account2['id']}/stats/")
+        self.assertEqual(response.json()["results"][0]["incoming_amount"], Decimal("50"))
+
+    def test_same_shard_payment(self):
+        """Test payment on one shard."""
+        response = self.pay(self.account2, self.account3, "30")
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(Payment.objects.using(self.shard1).filter(id=response.json()["id"]).exists())
+        self.assertEqual(self.balance(self.account2), Decimal("70"))
+        self.assertEqual(self.balance(self.account3), Decimal("130"))
+
+    def test_cross_shard_payment(self):
+        """Test two-phase commit payment."""
+        response = self.pay(self.account1, self.account2, "50")
+        self.assertEqual(response.status_code, 201)
+        payment_id = response.json()["id"]
+        self.assertEqual(self.client.get(f"/api/v1/payments/{payment_id}/").json()["amount"], Decimal("50"))
+        self.assertEqual(self.balance(self.account1), Decimal("250"))
+        self.assertEqual(self.balance(self.account2), Decimal("150"))
+        self.assertEqual(self.prepared(self.shard0) + self.prepared(self.shard1), [])
+
+        # Rollups of each account are on its shard
+        response = self.client.get(f"/api/v1/accounts/{self.account2['id']}/stats/")
+        self.assertEqual(response.json()["results"][0]["incoming_amount"], Decimal("50"))
+
+    def test_cross_shard_payment_neg(self):
+        """Test failed two-phase commit payment leaves nothing behind."""
+        response = self.pay(self.account2, self.account1, "1000")
+        self.assertEqual(response.status_code, 400)
+        uah = self.create_account(self.shard0, Account.UAH, "100")
+        response = self.pay(self.account2, uah, "10")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.balance(self.account2), Decimal("100"))
+        self.assertEqual(self.prepared(self.shard0) + self.prepared(self.shard1), [])
+
+    @staticmethod
+    def failing_decision(failures, written):
+        """Execute wrapper failing decision inserts, after them if written."""
+        attempts = count()
+
+        def execute(run, sql, params, many, context):
+            if sql.startswith("INSERT INTO payment_transfer_decision") and next(attempts) < failures:
+                if written:
+                    run(sql, params, many, context)
+                raise OperationalError("server closed the connection unexpectedly")
+            return run(sql, params, many, context)
+
+        return execute
+
+    def test_cross_shard_payment_decision_written(self):
+        """Test payment commits when decision is written before an error."""
+        with self.assertLogs("payments.service", "ERROR"):
+            with connections[self.shard0].execute_wrapper(self.failing_decision(1, written=True)):
+                response = self.pay(self.account1, self.account2, "50")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.balance(self.account1), Decimal("250"))
+        self.assertEqual(self.balance(self.account2), Decimal("150"))
+        self.assertEqual(self.prepared(self.shard0) + self.prepared(self.shard1), [])
+
+    def test_cross_shard_payment_in_doubt(self):
+        """Test payment with unknown decision is left for recovery."""
+        with self.assertLogs("payments.service", "ERROR"):
+            with connections[self.shard0].execute_wrapper(self.failing_decision(2, written=False)):
+                response = self.pay(self.account1, self.account2, "50")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(self.prepared(self.shard0) + self.prepared(self.shard1)), 2)
+
+        self.assertEqual(len(AccountPayment.recover(grace=0)), 2)
+        self.assertEqual(self.balance(self.account1), Decimal("300"))
+        self.assertEqual(self.balance(self.account2), Decimal("100"))
+
+    def pay_after(self, method, action):
+        """Make payment account1 -> account2, action(*args) before method."""
+        original = getattr(AccountPayment, method)
+
+        def late(*args):
+            action(*args)
+            return original(*args)
+
+        with patch.object(AccountPayment, method, side_effect=late):
+            return self.pay(self.account1, self.account2, "50")
+
+    def assertUnchanged(self):  # pylint: disable=C0103
+        """Payment account1 -> account2 left nothing behind."""
+        self.assertEqual(self.balance(self.account1), Decimal("300"))
+        self.assertEqual(self.balance(self.account2), Decimal("100"))
+        self.assertEqual(self.prepared(self.shard0) + self.prepared(self.shard1), [])
+
+    def test_cross_shard_payment_recovered(self):
+        """Test payment stalled until recovery rolled it back fails."""
+        with self.assertLogs("payments.service", "ERROR"):
+            response = self.pay_after("decide", lambda gid: AccountPayment.recover(grace=0))
+        self.assertEqual(response.status_code, 409)
+        self.assertUnchanged()
+
+    def test_cross_shard_payment_abort_claimed(self):
+        """Test payment fails when recovery claimed abort first."""
+        response = self.pay_after("decide", lambda gid: AccountPayment.claim(gid, ABORT))
+        self.assertEqual(response.status_code, 409)
+        self.assertUnchanged()
+
+    def test_cross_shard_payment_recovered_commit(self):
+        """Test payment committed by recovery after its decision succeeds."""
+        with self.assertLogs("payments.service", "ERROR"):
+            response = self.pay_after("commit_prepared", lambda *args: AccountPayment.recover(grace=0))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.balance(self.account1), Decimal("250"))
+        self.assertEqual(self.balance(self.account2), Decimal("150"))
+        self.assertEqual(self.prepared(self.shard0) + self.prepared(self.shard1), [])
+
+    def test_list_merged(self):
+        """Test lists read all shards."""
+        # Newest first: the second payment is on the second shard
+        payment_ids = [self.pay(self.account1, self.account2, "10").json()["id"]]
+        payment_ids.insert(0, self.pay(self.account2, self.account3, "10").json()["id"])
+        response = self.client.get("/api/v1/payments/")
+        self.assertEqual(response.json()["count"], sum(Payment.objects.using(a).count() for a in settings.SHARDS))
+        self.assertEqual([payment["id"] for payment in response.json()["results"][:2]], payment_ids)
+
+        response = self.client.get("/api/v1/accounts/")
+        created = [account["created_at"] for account in response.json()["results"]]
+        self.assertEqual(created, sorted(created, reverse=True))
+        self.assertEqual(
+            {account["id"] for account in response.json()["results"][:3]},
+            {self.account1["id"], self.account2["id"], self.account3["id"]},
+        )
+
+    def test_events_merged(self):
+        """Test events feed follows every shard."""
+        cursor = self.client.get("/api/v1/events/", {"timeout": 0}).json()["cursor"]
+        self.assertEqual(len(cursor.split(".")), len(settings.SHARDS))
+        payment_ids = [
+            self.pay(self.account2, self.account3, "10").json()["id"],
+            self.pay(self.account1, self.account2, "10").json()["id"],
+        ]
+        # Prepared transactions can not NOTIFY, cross-shard events come on poll
+        event_ids = []
+        for _ in payment_ids:
+            response = self.client.get("/api/v1/events/", {"cursor": cursor, "timeout": 5})
+            self.assertEqual(response.status_code, 200)
+            event_ids += [event["id"] for event in response.json()["results"]]
+            cursor = response.json()["cursor"]
+        self.assertEqual(sorted(event_ids), sorted(payment_ids))
+
+        # Resume, nothing new
+        response = self.client.get("/api/v1/events/", {"cursor": cursor, "timeout": 0})
+        self.assertEqual(response.json()["results"], [])
+
+    def test_on_shards_concurrent(self):
+        """Test concurrent requests fan out in parallel, not one by one."""
+        barrier = threading.Barrier(2 * len(settings.SHARDS), timeout=5)
+        requests = [threading.Thread(target=on_shards, args=(lambda alias: barrier.wait(),)) for _ in range(2)]
+        with override_settings(SHARD_POOL_SIZE=2):
+            executor.cache_clear()
+            for request in requests:
+                request.start()
+            for request in requests:
+                request.join()
+        executor.cache_clear()
+        self.assertFalse(barrier.broken)
+
+    def test_recover(self):
+        """Test recovery of in-doubt cross-shard payments."""
+        self.prepare(self.shard1, "payment-commit", self.account2, "1")
+        self.prepare(self.shard1, "payment-rollback", self.account3, "2")
+        with connections[settings.SHARDS[0]].cursor() as cur:
+            cur.execute("INSERT INTO payment_transfer_decision (gid, outcome) VALUES ('payment-commit', 'commit')")
+
+        # Too young
+        self.assertEqual(AccountPayment.recover(grace=3600), [])
+        self.assertEqual(len(self.prepared(self.shard1)), 2)
+
+        recovered = AccountPayment.recover(grace=0)
+        self.assertEqual(
+            sorted(recovered), [("payment-commit", self.shard1, True), ("payment-rollback", self.shard1, False)]
+        )
+        self.assertEqual(self.prepared(self.shard1), [])
+        self.assertEqual(self.balance(self.account2), Decimal("1"))
+        self.assertEqual(self.balance(self.account3), Decimal("100"))
+        with connections[settings.SHARDS[0]].cursor() as cur:
+            cur.execute("SELECT count(*) FROM payment_transfer_decision")
+            self.assertEqual(cur.fetchone()[0], 0)
@@ -1,15 +1,48 @@
 """DRF views layer."""
 
+from django.http import StreamingHttpResponse
+from django.utils.cache import get_conditional_response
 from rest_framework import mixins, viewsets
+from rest_framework.decorators import action
 from rest_framework.response import Response
 
+from payments.events import EventHub, format_cursor, parse_cursor
 from payments.models import Account, Payment
-from payments.serializers import AccountSerializer, PaymentSerializer
-from payments.service import AccountPayment
+from payments.pagination import AccountNamePagination
+from payments.renderers import EventStreamRenderer
+from payments.serializers import (
+    AccountSerializer,
+    CurrencyTurnoverSerializer,
+    EventQuerySerializer,
+    PaymentSerializer,
+    StatsQuerySerializer,
+    TurnoverSerializer,
+)
+from payments.service import AccountPayment, AccountSearch, TurnoverRollup
+from payments.sharding import ShardedQuerySet, shard_for_id
+
+
+class ShardedViewMixin:
+    """Route queries to shards: detail views by id, lists to all shards."""
+
+    def get_queryset(self):
+        """Queryset of the shard of the requested id or of all shards."""
+        queryset = super().get_queryset()
+        pk = self.kwargs.get(self.lookup_url_kwarg or self.lookup_field)
+        if pk is None:
+            return ShardedQuerySet.from_queryset(queryset)
+        try:
+            return queryset.using(shard_for_id(pk))
+        except ValueError:
+            return queryset.none()
 
 
 class CreateListRetrieveViewSet(
-    mixins.CreateModelMixin, mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet
+    ShardedViewMixin,
+    mixins.CreateModelMixin,
+    mixins.ListModelMixin,
+    mixins.RetrieveModelMixin,
+    viewsets.GenericViewSet,
 ):
     """A viewset that provides `retrieve`, `create`, and `list` actions."""
 
@@ -19,11 +52,60 @@ class AccountViewSet(CreateListRetrieveViewSet):
 
     Provide only **create** and view operation.
     You can not modify accounts.
+
+    Find accounts by name:
+      * `?name=` exact name
+      * `?search=` name prefix or similar name
+
+    Poll an account with `If-None-Match`, its `ETag` changes with balance.
     """
 
     queryset = Account.objects.all()
     serializer_class = AccountSerializer
 
+    def list(self, request, *args, **kwargs):
+        """List accounts, optionally filtered by name."""
+        if "name" in request.query_params:
+            account = AccountSearch.exact(request.query_params["name"])
+            results = self.get_serializer([account] if account else [], many=True).data
+            return Response({"next": None, "previous": None, "results": results})
+        if "search" in request.query_params:
+            self.pagination_class = AccountNamePagination
+        return super().list(request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        """Account with `ETag`, 304 if `If-None-Match` matches."""
+        account = self.get_object()
+        etag = f'"{account.version}"'
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = Response(self.get_serializer(account).data)
+        response["ETag"] = etag
+        return response
+
+    def get_queryset(self):
+        """Search accounts by name."""
+        if self.action == "list" and "search" in self.request.query_params:
+            return AccountSearch.search(self.request.query_params["search"])
+        return super().get_queryset()
+
+    @action(detail=True)
+    def stats(self, request, pk=None):  # pylint: disable=W0613
+        """Account turnover by `period` (day, month) from `start` to `end`."""
+        account = self.get_object()
+        query = StatsQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        turnover = TurnoverRollup.account(account.id, params["period"], params["start"], params["end"])
+        return Response(
+            {
+                "account_id": account.id,
+                "currency": account.currency,
+                "period": params["period"],
+                "results": TurnoverSerializer(turnover, many=True).data,
+            }
+        )
+
 
 class PaymentViewSet(CreateListRetrieveViewSet):
     """API endpoint that allows **create** and view `Payments`.
@@ -44,3 +126,52 @@ class PaymentViewSet(CreateListRetrieveViewSet):
         payment = AccountPayment.transaction(**serializer.validated_data)
         serializer = self.serializer_class(payment)
         return Response(serializer.data, status=201)
+
+
+class StatsViewSet(viewsets.ViewSet):
+    """API endpoint that allows view turnover statistics by currency.
+
+    Filter by `period` (day, month), `start`, `end` and `currency`.
+    """
+
+    def list(self, request):
+        """Currency turnover."""
+        query = StatsQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        turnover = TurnoverRollup.currency(params["period"], params["start"], params["end"], params.get("currency"))
+        return Response({"period": params["period"], "results": CurrencyTurnoverSerializer(turnover, many=True).data})
+
+
+class EventViewSet(viewsets.ViewSet):
+    """API endpoint that allows follow new `Payments`.
+
+    Long poll `GET /api/v1/events/` or server-sent events
+    `GET /api/v1/events/stream/`, resume from `cursor` (or `Last-Event-ID`),
+    filter by `account`.
+    """
+
+    def list(self, request):
+        """Payment events after cursor, wait up to `timeout` seconds."""
+        query = EventQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        cursor = parse_cursor(params["cursor"]) if "cursor" in params else None
+        cursor, events = EventHub.instance().wait(cursor, params.get("account"), params["timeout"])
+        return Response({"cursor": format_cursor(cursor), "results": [event.payload for event in events]})
+
+    @action(detail=False, renderer_classes=[EventStreamRenderer])
+    def stream(self, request):
+        """Payment events stream."""
+        query = EventQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        cursor = params.get("cursor", request.META.get("HTTP_LAST_EVENT_ID"))
+        cursor = parse_cursor(cursor) if cursor else None
+        response = StreamingHttpResponse(
+            EventHub.instance().stream(cursor, params.get("account")), content_type=EventStreamRenderer.media_type
+        )
+        response["Cache-Control"] = "no-cache"
+        # Disable nginx proxy buffering
+        response["X-Accel-Buffering"] = "no"
+        return response